@@ -0,0 +1,256 @@
+// Draws layers packed by worker.js straight from their typed arrays.
+//
+// Each layer is projected once, in a worker, into a Float32Array of base
+// (untransformed) screen coordinates. Pan/zoom only blits a snapshot of the
+// last frame; the full redraw at the new transform happens on zoom end and
+// skips features outside the viewport. Adding a layer draws just that layer
+// on top.
+//
+// Hit-testing searches the layer's packed R-tree of feature boxes, then
+// tests only the segment chunks near the cursor, so its cost does not grow
+// as you zoom into dense layers.
+
+// Mirrors the path.feature / circle.feature rules in style.css
+const FEATURE_STYLE = {stroke: "#000000", fill: "#0000ff", width: 0.5, alpha: 0.8};
+const HIGHLIGHT_STYLE = {stroke: "#00ff00", fill: "#00ffff", width: 1, alpha: 1};
+// Must match NODE_SIZE in worker.js
+const INDEX_NODE_SIZE = 16;
+
+class CanvasRenderer {
+    constructor(container, width, height, workerPool) {
+        this.canvas = container.insert("canvas", ":first-child").attr("class", "layer-canvas");
+        this.highlight = container.insert("canvas", ":nth-child(2)").attr("class", "layer-canvas");
+        this.context = this.canvas.node().getContext("2d");
+        this.highlightContext = this.highlight.node().getContext("2d");
+        this.snapshot = document.createElement("canvas");
+        this.snapshotTransform = null;
+        this.workerPool = workerPool;
+        // Layers in draw order; a layer still being projected maps to null
+        this.layers = new Map();
+        this.pending = new Map();
+        this.transform = d3.zoomIdentity;
+        this.resize(width, height);
+    }
+
+    resize(width, height) {
+        this.width = width;
+        this.height = height;
+        this.ratio = window.devicePixelRatio || 1;
+        [this.canvas, this.highlight].forEach(canvas => canvas
+            .attr("width", width * this.ratio)
+            .attr("height", height * this.ratio)
+            .style("width", `${width}px`)
+            .style("height", `${height}px`));
+        this.redraw();
+    }
+
+    clear() {
+        this.layers.clear();
+        this.pending.clear();
+        this.redraw();
+    }
+
+    // Resolves once the layer is projected and drawn, or with null if it was
+    // removed or replaced in the meantime
+    async addLayer(id, layer, projection) {
+        const token = {};
+        this.pending.set(id, token);
+        if (!this.layers.has(id)) this.layers.set(id, null);
+
+        const entry = {layer, ...await this.workerPool.project(layer, projection)};
+        if (this.pending.get(id) !== token) return null;
+        this.pending.delete(id);
+        this.layers.set(id, entry);
+
+        const ids = Array.from(this.layers.keys());
+        if (ids.slice(ids.indexOf(id) + 1).every(later => !this.layers.get(later))) {
+            this.drawLayer(this.context, entry, this.viewport());
+        } else {
+            // Keep the draw order when an earlier layer finishes after a later one
+            this.redraw();
+        }
+        return entry;
+    }
+
+    removeLayer(id) {
+        this.pending.delete(id);
+        if (this.layers.delete(id)) this.redraw();
+    }
+
+    viewport() {
+        const [x0, y0] = this.transform.invert([0, 0]);
+        const [x1, y1] = this.transform.invert([this.width, this.height]);
+        return [x0, y0, x1, y1];
+    }
+
+    applyTransform(context) {
+        const t = this.transform, r = this.ratio;
+        context.setTransform(r * t.k, 0, 0, r * t.k, r * t.x, r * t.y);
+    }
+
+    drawLayer(context, entry, viewport, features, style = FEATURE_STYLE) {
+        const {layer, projected, boxes} = entry;
+        const {ringOffsets, partOffsets, featureOffsets, types} = layer;
+        const [vx0, vy0, vx1, vy1] = viewport;
+        const scale = this.transform.k;
+
+        this.applyTransform(context);
+        context.globalAlpha = style.alpha;
+        context.lineWidth = style.width / scale;
+        context.strokeStyle = style.stroke;
+        context.fillStyle = style.fill;
+
+        const lines = new Path2D();
+        const points = new Path2D();
+        const radius = 2 / scale;
+        const visible = features || types.keys();
+        for (const f of visible) {
+            if (boxes[f * 4] > vx1 || boxes[f * 4 + 2] < vx0 ||
+                boxes[f * 4 + 1] > vy1 || boxes[f * 4 + 3] < vy0) continue;
+
+            for (let p = featureOffsets[f]; p < featureOffsets[f + 1]; p++) {
+                for (let r = partOffsets[p]; r < partOffsets[p + 1]; r++) {
+                    const start = ringOffsets[r], end = ringOffsets[r + 1];
+                    if (types[f] === 0) {
+                        points.rect(projected[start * 2] - radius, projected[start * 2 + 1] - radius, radius * 2, radius * 2);
+                        continue;
+                    }
+                    lines.moveTo(projected[start * 2], projected[start * 2 + 1]);
+                    for (let i = start + 1; i < end; i++) {
+                        lines.lineTo(projected[i * 2], projected[i * 2 + 1]);
+                    }
+                    if (types[f] === 2) lines.closePath();
+                }
+            }
+        }
+        context.stroke(lines);
+        context.fill(points);
+        context.stroke(points);
+    }
+
+    redraw() {
+        const context = this.context;
+        context.setTransform(1, 0, 0, 1, 0, 0);
+        context.clearRect(0, 0, this.width * this.ratio, this.height * this.ratio);
+        const viewport = this.viewport();
+        this.layers.forEach(entry => entry && this.drawLayer(context, entry, viewport));
+        this.clearHighlight();
+    }
+
+    // While zooming, scale the last full frame instead of redrawing it
+    zoom(transform) {
+        if (!this.snapshotTransform) {
+            this.snapshot.width = this.canvas.node().width;
+            this.snapshot.height = this.canvas.node().height;
+            this.snapshot.getContext("2d").drawImage(this.canvas.node(), 0, 0);
+            this.snapshotTransform = this.transform;
+            this.clearHighlight();
+        }
+        this.transform = transform;
+
+        const s = this.snapshotTransform, r = this.ratio, k = transform.k / s.k;
+        const context = this.context;
+        context.setTransform(1, 0, 0, 1, 0, 0);
+        context.clearRect(0, 0, this.width * r, this.height * r);
+        context.setTransform(k, 0, 0, k, r * (transform.x - k * s.x), r * (transform.y - k * s.y));
+        context.drawImage(this.snapshot, 0, 0);
+    }
+
+    zoomEnd(transform) {
+        this.transform = transform;
+        this.snapshotTransform = null;
+        this.redraw();
+    }
+
+    hitTest(mouseX, mouseY) {
+        const [x, y] = this.transform.invert([mouseX, mouseY]);
+        const tolerance = 3 / this.transform.k;
+
+        // Most recently added layers are drawn on top, so test them first,
+        // and later features within a layer before earlier ones
+        const entries = Array.from(this.layers.values()).filter(Boolean).reverse();
+        for (const entry of entries) {
+            const candidates = searchIndex(entry.index, x - tolerance, y - tolerance, x + tolerance, y + tolerance);
+            candidates.sort((a, b) => b - a);
+            for (const f of candidates) {
+                if (this.featureContains(entry, f, x, y, tolerance)) {
+                    return {entry, index: f};
+                }
+            }
+        }
+        return null;
+    }
+
+    featureContains(entry, f, x, y, tolerance) {
+        const {layer, projected, chunkBoxes, chunkStarts, chunkEnds, featureChunks} = entry;
+        const polygon = layer.types[f] === 2;
+
+        let inside = false;
+        for (let c = featureChunks[f]; c < featureChunks[f + 1]; c++) {
+            const x0 = chunkBoxes[c * 4], y0 = chunkBoxes[c * 4 + 1];
+            const x1 = chunkBoxes[c * 4 + 2], y1 = chunkBoxes[c * 4 + 3];
+            const near = x >= x0 - tolerance && x <= x1 + tolerance && y >= y0 - tolerance && y <= y1 + tolerance;
+            // Only chunks spanning y that reach right of x can cross the ray
+            const crossing = polygon && y >= y0 && y <= y1 && x1 >= x;
+            if (!near && !crossing) continue;
+
+            const start = chunkStarts[c], end = chunkEnds[c];
+            if (start === end) {
+                if (near && Math.hypot(projected[start * 2] - x, projected[start * 2 + 1] - y) <= tolerance) return true;
+                continue;
+            }
+            for (let i = start + 1; i <= end; i++) {
+                const ax = projected[i * 2 - 2], ay = projected[i * 2 - 1];
+                const bx = projected[i * 2], by = projected[i * 2 + 1];
+                if (near && segmentDistance(x, y, ax, ay, bx, by) <= tolerance) return true;
+                if (crossing && ((ay > y) !== (by > y)) &&
+                    x < (bx - ax) * (y - ay) / (by - ay) + ax) inside = !inside;
+            }
+        }
+        return inside;
+    }
+
+    highlightFeature(hit) {
+        this.clearHighlight();
+        if (!hit) return;
+        this.drawLayer(this.highlightContext, hit.entry, this.viewport(), [hit.index], HIGHLIGHT_STYLE);
+    }
+
+    clearHighlight() {
+        const context = this.highlightContext;
+        context.setTransform(1, 0, 0, 1, 0, 0);
+        context.clearRect(0, 0, this.width * this.ratio, this.height * this.ratio);
+    }
+}
+
+// Features whose box intersects the query box, from the packed R-tree built
+// by buildIndex in worker.js
+function searchIndex(index, x0, y0, x1, y1) {
+    const {nodeBoxes, indices, levelBounds, count} = index;
+    const results = [];
+    if (!count) return results;
+    const queue = [];
+    let node = nodeBoxes.length - 4;
+    while (node !== undefined) {
+        const levelEnd = levelBounds.find(bound => bound > node);
+        const end = Math.min(node + INDEX_NODE_SIZE * 4, levelEnd);
+        for (let pos = node; pos < end; pos += 4) {
+            if (x1 < nodeBoxes[pos] || y1 < nodeBoxes[pos + 1] ||
+                x0 > nodeBoxes[pos + 2] || y0 > nodeBoxes[pos + 3]) continue;
+            if (node >= count * 4) {
+                queue.push(indices[pos >> 2]);
+            } else {
+                results.push(indices[pos >> 2]);
+            }
+        }
+        node = queue.pop();
+    }
+    return results;
+}
+
+function segmentDistance(x, y, ax, ay, bx, by) {
+    const dx = bx - ax, dy = by - ay;
+    const length = dx * dx + dy * dy;
+    const t = length ? Math.max(0, Math.min(1, ((x - ax) * dx + (y - ay) * dy) / length)) : 0;
+    return Math.hypot(x - (ax + t * dx), y - (ay + t * dy));
+}
@@ -9,23 +9,41 @@ const svg = d3.select("#map")
     .attr("xmlns", "http://www.w3.org/2000/svg")
     .attr("xmlns:xlink", "http://www.w3.org/1999/xlink");
 
+// All SVG layers live in one group so zooming updates a single transform
+const layerGroup = svg.append("g").attr("class", "layers");
+
 const zoom = d3.zoom()
     .scaleExtent([1, 512])
-    .on("zoom", zoomed);
+    .on("zoom", zoomed)
+    .on("end", zoomEnded);
 
 svg.call(zoom);
 
 function zoomed(event) {
-    svg.selectAll("path")
-        .attr("transform", event.transform);
-    svg.selectAll("circle")
-        .attr("transform", event.transform);
+    currentTransform = event.transform;
+    if (renderMode === "canvas") {
+        canvasRenderer.zoom(event.transform);
+    } else {
+        layerGroup.attr("transform", event.transform);
+    }
 }
 
-let fileContent = '';
-let topology = null;
-let features = null;
-let activeFeatures = new Map();
+function zoomEnded(event) {
+    if (renderMode === "canvas") {
+        canvasRenderer.zoomEnd(event.transform);
+    }
+    if (viewportLoader.active && projection) {
+        viewportLoader.update(viewBounds());
+    }
+}
+
+let renderMode = "canvas";
+let currentTransform = d3.zoomIdentity;
+let projection = null;
+// Packed layers from the worker pool, keyed by layer id
+let activeLayers = new Map();
+// GeoJSON rebuilt from the packed layers, only needed by the SVG renderer
+let svgFeatures = new Map();
 
 function updateProgress(type, percent, text) {
     d3.select(`#${type}-progress`)
@@ -34,65 +52,148 @@ function updateProgress(type, percent, text) {
         .text(`${text}: ${Math.round(percent)}%`);
 }
 
-async function processJSON(content, updateCallback) {
-    const chunkSize = 1024 * 1024;
-    const totalChunks = Math.ceil(content.length / chunkSize);
-    let processed = 0;
+// Fetching, JSON parsing and TopoJSON decoding run in worker.js; each task
+// resolves with typed-array geometry buffers transferred from the worker.
+class WorkerPool {
+    constructor(size) {
+        this.workers = Array.from({length: size}, () => new Worker("worker.js"));
+        this.idle = [...this.workers];
+        this.queue = [];
+        this.tasks = new Map();
+        this.nextId = 0;
+        this.workers.forEach(worker => {
+            worker.onmessage = event => this.handleMessage(worker, event.data);
+        });
+    }
 
-    for (let i = 0; i < totalChunks; i++) {
-        const start = i * chunkSize;
-        const end = Math.min(start + chunkSize, content.length);
-        processed = (i + 1) / totalChunks * 100;
-        updateCallback(processed);
-        await new Promise(resolve => setTimeout(resolve, 0));
+    load(message, onProgress, signal) {
+        return new Promise((resolve, reject) => {
+            const id = this.nextId++;
+            this.tasks.set(id, {resolve, reject, onProgress, worker: null});
+            this.queue.push({id, ...message});
+            if (signal) {
+                signal.addEventListener("abort", () => this.cancel(id), {once: true});
+            }
+            this.dispatch();
+        });
+    }
+
+    // Queued tasks are dropped; running ones have their fetch aborted
+    cancel(id) {
+        const task = this.tasks.get(id);
+        if (!task) return;
+        const queued = this.queue.findIndex(message => message.id === id);
+        if (queued >= 0) {
+            this.queue.splice(queued, 1);
+            this.tasks.delete(id);
+            task.reject(new DOMException("Aborted", "AbortError"));
+        } else if (task.worker) {
+            task.worker.postMessage({type: "cancel", id});
+        }
+    }
+
+    dispatch() {
+        while (this.idle.length && this.queue.length) {
+            const message = this.queue.shift();
+            const worker = this.idle.pop();
+            this.tasks.get(message.id).worker = worker;
+            worker.postMessage(message);
+        }
     }
 
-    return JSON.parse(content);
+    // Base screen coordinates and the hit-test index for the canvas renderer.
+    // The geometry is copied to the worker, so the layer stays usable here.
+    project(layer, projection) {
+        const {coords, ringOffsets, partOffsets, featureOffsets, types} = layer;
+        return this.load({
+            type: "project",
+            layer: {coords, ringOffsets, partOffsets, featureOffsets, types},
+            projection: {
+                scale: projection.scale(),
+                translate: projection.translate(),
+                center: projection.center(),
+                rotate: projection.rotate()
+            }
+        });
+    }
+
+    handleMessage(worker, data) {
+        const task = this.tasks.get(data.id);
+        if (!task) return;
+        if (data.type === "progress") {
+            if (task.onProgress) task.onProgress(data.stage, data.percent);
+            return;
+        }
+
+        this.tasks.delete(data.id);
+        this.idle.push(worker);
+        this.dispatch();
+        if (data.type === "result") {
+            task.resolve(data.layer);
+        } else if (data.aborted) {
+            task.reject(new DOMException("Aborted", "AbortError"));
+        } else {
+            task.reject(new Error(data.message));
+        }
+    }
 }
 
-async function handleDrop(event) {
-    event.preventDefault();
-    const file = event.dataTransfer.files[0];
-    
-    if (!file.name.endsWith('.topojson')) {
-        alert("Please drop a valid .topojson file.");
-        return;
+const workerPool = new WorkerPool(Math.min(navigator.hardwareConcurrency || 2, 4));
+const canvasRenderer = new CanvasRenderer(d3.select("#map"), width, height, workerPool);
+
+// Rebuild GeoJSON features from the packed buffers for the SVG renderer
+function unpackFeatures(layer) {
+    const {coords, ringOffsets, partOffsets, featureOffsets, types} = layer;
+    const point = i => [coords[i * 2], coords[i * 2 + 1]];
+    const ring = r => {
+        const points = [];
+        for (let i = ringOffsets[r]; i < ringOffsets[r + 1]; i++) points.push(point(i));
+        return points;
+    };
+    const part = p => {
+        const rings = [];
+        for (let r = partOffsets[p]; r < partOffsets[p + 1]; r++) rings.push(ring(r));
+        return rings;
+    };
+
+    const features = [];
+    for (let f = 0; f < types.length; f++) {
+        const parts = [];
+        for (let p = featureOffsets[f]; p < featureOffsets[f + 1]; p++) parts.push(part(p));
+
+        let geometry;
+        if (types[f] === 0) {
+            geometry = {type: "MultiPoint", coordinates: parts.map(rings => rings[0][0])};
+        } else if (types[f] === 1) {
+            geometry = {type: "MultiLineString", coordinates: parts.map(rings => rings[0])};
+        } else {
+            geometry = {type: "MultiPolygon", coordinates: parts};
+        }
+        features.push({
+            type: "Feature",
+            id: layer.ids[f],
+            properties: layer.properties[f],
+            sidecar: layer.sidecar,
+            geometry
+        });
     }
+    return {type: "FeatureCollection", features};
+}
 
+async function loadLayer(message) {
     d3.select("#progress-overlay").classed("hidden", false);
     updateProgress("file", 0, "File Loading");
     updateProgress("parse", 0, "Parsing TopoJSON");
     updateProgress("render", 0, "Rendering Features");
 
     try {
-        const reader = new FileReader();
-        reader.onprogress = (e) => {
-            if (e.lengthComputable) {
-                const percent = (e.loaded / e.total) * 100;
-                updateProgress("file", percent, "File Loading");
-            }
-        };
-
-        fileContent = await new Promise((resolve, reject) => {
-            reader.onload = e => resolve(e.target.result);
-            reader.onerror = () => reject(reader.error);
-            reader.readAsText(file);
+        const layer = await workerPool.load(message, (stage, percent) => {
+            updateProgress(stage, percent, stage === "file" ? "File Loading" : "Parsing TopoJSON");
         });
 
-        updateProgress("file", 100, "File Loading");
-
-        topology = await processJSON(fileContent, (percent) => {
-            updateProgress("parse", percent, "Parsing TopoJSON");
-        });
-
-        const objectName = Object.keys(topology.objects)[0];
-        features = topojson.feature(topology, topology.objects[objectName]);
-        
         // Store features with a unique ID
         const layerId = Date.now().toString();
-        activeFeatures.set(layerId, features);
-
-        await renderFeatures();
+        await addLayer(layerId, layer);
 
         setTimeout(() => {
             d3.select("#progress-overlay").classed("hidden", true);
@@ -105,67 +206,302 @@ async function handleDrop(event) {
     }
 }
 
-async function renderFeatures() {
-    svg.selectAll("*").remove();
-
-    // Calculate bounds for all active feature sets
-    let combinedBounds = null;
-    activeFeatures.forEach(features => {
-        const bounds = d3.geoBounds(features);
-        if (!combinedBounds) {
-            combinedBounds = bounds;
+// Layers written in sidecar mode carry only feature ids; their properties
+// are fetched from /api/attributes when a feature is first hovered. Requests
+// made within a short window are batched into one call per sidecar.
+const attributeCache = new Map();
+const pendingAttributes = new Map();
+
+function fetchProperties(sidecar, id) {
+    const key = `${sidecar.layer}/${sidecar.file}`;
+    if (!attributeCache.has(key)) attributeCache.set(key, new Map());
+    const cache = attributeCache.get(key);
+    if (cache.has(id)) return Promise.resolve(cache.get(id));
+
+    if (!pendingAttributes.has(key)) {
+        const batch = {ids: new Map()};
+        pendingAttributes.set(key, batch);
+        setTimeout(async () => {
+            pendingAttributes.delete(key);
+            const ids = Array.from(batch.ids.keys());
+            try {
+                const response = await fetch(`/api/attributes/${key}?ids=${ids.join(",")}`);
+                const data = await response.json();
+                ids.forEach(i => {
+                    const properties = data.properties[i] || {};
+                    cache.set(i, properties);
+                    batch.ids.get(i).forEach(resolve => resolve(properties));
+                });
+            } catch (error) {
+                console.error("Error fetching attributes:", error);
+                ids.forEach(i => batch.ids.get(i).forEach(resolve => resolve({})));
+            }
+        }, 50);
+    }
+
+    const batch = pendingAttributes.get(key);
+    return new Promise(resolve => {
+        if (!batch.ids.has(id)) batch.ids.set(id, []);
+        batch.ids.get(id).push(resolve);
+    });
+}
+
+function tooltipText(properties) {
+    return Object.entries(properties || {})
+        .map(([key, value]) => `${key}: ${value}`)
+        .join('\n');
+}
+
+// Tooltips are built on first hover instead of for every feature up front
+async function showTooltip(event, d) {
+    const element = d3.select(this);
+    if (!element.select("title").empty()) return;
+    const title = element.append("title");
+
+    let properties = d.properties;
+    if (d.sidecar && d.id !== undefined) {
+        properties = await fetchProperties(d.sidecar, d.id);
+    }
+    title.text(tooltipText(properties));
+}
+
+async function handleDrop(event) {
+    event.preventDefault();
+    const file = event.dataTransfer.files[0];
+    
+    if (!file.name.endsWith('.topojson')) {
+        alert("Please drop a valid .topojson file.");
+        return;
+    }
+
+    await loadLayer({file});
+}
+
+// Layers can also be loaded straight from the data server
+async function populateLayerList() {
+    try {
+        const response = await fetch("/api/layers");
+        const {layers} = await response.json();
+        const layerSelect = d3.select("#layer-select");
+        layerSelect.selectAll("option")
+            .data(Object.keys(layers))
+            .join("option")
+            .attr("value", d => d)
+            .text(d => d);
+
+        const showFiles = () => {
+            d3.select("#file-select").selectAll("option")
+                .data(layers[layerSelect.property("value")] || [])
+                .join("option")
+                .attr("value", d => d)
+                .text(d => d);
+        };
+        layerSelect.on("change", showFiles);
+        showFiles();
+    } catch (error) {
+        console.error("Error listing layers:", error);
+    }
+}
+
+d3.select("#load-button").on("click", () => {
+    const layer = d3.select("#layer-select").property("value");
+    const file = d3.select("#file-select").property("value");
+    if (layer && file) {
+        loadLayer({url: `/${layer}/${file}`});
+    }
+});
+
+populateLayerList();
+
+function combinedBounds() {
+    let bounds = null;
+    activeLayers.forEach(layer => {
+        const [x0, y0, x1, y1] = layer.bounds;
+        if (!bounds) {
+            bounds = [[x0, y0], [x1, y1]];
         } else {
-            combinedBounds = [
-                [Math.min(bounds[0][0], combinedBounds[0][0]), Math.min(bounds[0][1], combinedBounds[0][1])],
-                [Math.max(bounds[1][0], combinedBounds[1][0]), Math.max(bounds[1][1], combinedBounds[1][1])]
+            bounds = [
+                [Math.min(x0, bounds[0][0]), Math.min(y0, bounds[0][1])],
+                [Math.max(x1, bounds[1][0]), Math.max(y1, bounds[1][1])]
             ];
         }
     });
+    return bounds;
+}
 
-    const projection = d3.geoMercator().fitSize([width, height], {
+function fitProjection(bounds = combinedBounds()) {
+    projection = d3.geoMercator().fitSize([width, height], {
         type: "Feature",
         geometry: {
             type: "LineString",
-            coordinates: combinedBounds
+            coordinates: bounds
         }
     });
+}
+
+// [west, south, east, north] of what is currently on screen
+function viewBounds() {
+    const [x0, y0] = currentTransform.invert([0, 0]);
+    const [x1, y1] = currentTransform.invert([width, height]);
+    const [west, north] = projection.invert([x0, y0]);
+    const [east, south] = projection.invert([x1, y1]);
+    return [west, south, east, north];
+}
+
+function fitsProjection(bounds) {
+    const [x0, y0] = projection([bounds[0], bounds[3]]);
+    const [x1, y1] = projection([bounds[2], bounds[1]]);
+    return x0 >= -1 && y0 >= -1 && x1 <= width + 1 && y1 <= height + 1;
+}
+
+// New layers are drawn on top of what is already rendered. Only a layer that
+// falls outside the current projection forces a refit and a full redraw.
+async function addLayer(layerId, layer) {
+    activeLayers.set(layerId, layer);
+    if (!projection || !fitsProjection(layer.bounds)) {
+        fitProjection();
+        svg.call(zoom.transform, d3.zoomIdentity);
+        await renderFeatures();
+    } else if (renderMode === "canvas") {
+        await canvasRenderer.addLayer(layerId, layer, projection);
+        updateProgress("render", 100, "Rendering Features");
+    } else {
+        await renderSvgLayer(layerId, layer);
+    }
+}
+
+function removeLayer(layerId) {
+    activeLayers.delete(layerId);
+    svgFeatures.delete(layerId);
+    canvasRenderer.removeLayer(layerId);
+    layerGroup.selectAll("g").filter(function() {
+        return this.dataset.layerId === layerId;
+    }).remove();
+}
+
+async function renderFeatures() {
+    canvasRenderer.clear();
+    layerGroup.selectAll("*").remove();
+    if (!projection) return;
+
+    if (renderMode === "canvas") {
+        canvasRenderer.transform = currentTransform;
+        await Promise.all(Array.from(activeLayers,
+            ([layerId, layer]) => canvasRenderer.addLayer(layerId, layer, projection)));
+        updateProgress("render", 100, "Rendering Features");
+        return;
+    }
 
+    layerGroup.attr("transform", currentTransform);
+    for (const [layerId, layer] of activeLayers) {
+        await renderSvgLayer(layerId, layer);
+    }
+}
+
+async function renderSvgLayer(layerId, layer) {
+    if (!svgFeatures.has(layerId)) {
+        svgFeatures.set(layerId, unpackFeatures(layer));
+    }
+    const features = svgFeatures.get(layerId);
     const path = d3.geoPath().projection(projection);
+    const group = layerGroup.append("g").attr("data-layer-id", layerId);
 
-    let totalFeatures = 0;
-    activeFeatures.forEach(features => {
-        totalFeatures += features.features.length;
-    });
+    const featureChunkSize = 100;
+    for (let i = 0; i < features.features.length; i += featureChunkSize) {
+        const chunk = features.features.slice(i, i + featureChunkSize);
 
-    let renderedFeatures = 0;
-
-    // Render all active feature sets
-    for (const [layerId, features] of activeFeatures) {
-        const featureChunkSize = 100;
-        for (let i = 0; i < features.features.length; i += featureChunkSize) {
-            const chunk = features.features.slice(i, i + featureChunkSize);
-            
-            svg.selectAll(`path.feature-chunk-${layerId}-${i}`)
-                .data(chunk)
-                .join("path")
-                .attr("class", d => `feature feature-chunk-${layerId}-${i}`)
-                .attr("d", path)
-                .attr("vector-effect", "non-scaling-stroke")
-                .append("title")
-                .text(d => Object.entries(d.properties)
-                    .map(([key, value]) => `${key}: ${value}`)
-                    .join('\n')
-                );
-
-            renderedFeatures += chunk.length;
-            const renderPercent = (renderedFeatures / totalFeatures) * 100;
-            updateProgress("render", renderPercent, "Rendering Features");
-            
-            await new Promise(resolve => setTimeout(resolve, 0));
-        }
+        group.selectAll(`path.feature-chunk-${i}`)
+            .data(chunk)
+            .join("path")
+            .attr("class", `feature feature-chunk-${i}`)
+            .attr("d", path)
+            .attr("vector-effect", "non-scaling-stroke")
+            .on("mouseenter", showTooltip);
+
+        const renderPercent = Math.min(i + featureChunkSize, features.features.length) / features.features.length * 100;
+        updateProgress("render", renderPercent, "Rendering Features");
+
+        await new Promise(resolve => setTimeout(resolve, 0));
     }
 }
 
+// Canvas mode has no per-feature elements, so hovering goes through the
+// worker's packed Hilbert R-tree (buildIndex in worker.js) and a positioned tooltip
+const tooltip = d3.select("#tooltip");
+let hoverFrame = null;
+let hoverToken = 0;
+
+async function showCanvasTooltip(x, y, pageX, pageY) {
+    const token = ++hoverToken;
+    const hit = canvasRenderer.hitTest(x, y);
+    canvasRenderer.highlightFeature(hit);
+    if (!hit) {
+        tooltip.classed("hidden", true);
+        return;
+    }
+
+    const {layer} = hit.entry;
+    let properties = layer.properties[hit.index];
+    if (layer.sidecar && layer.ids[hit.index] !== undefined) {
+        properties = await fetchProperties(layer.sidecar, layer.ids[hit.index]);
+    }
+    if (token !== hoverToken) return;
+    tooltip.classed("hidden", false)
+        .style("left", `${pageX + 12}px`)
+        .style("top", `${pageY + 12}px`)
+        .text(tooltipText(properties));
+}
+
+svg.on("mousemove", event => {
+    if (renderMode !== "canvas") return;
+    const [x, y] = d3.pointer(event);
+    if (hoverFrame) cancelAnimationFrame(hoverFrame);
+    hoverFrame = requestAnimationFrame(() => showCanvasTooltip(x, y, event.pageX, event.pageY));
+});
+
+svg.on("mouseleave", () => {
+    hoverToken++;
+    canvasRenderer.highlightFeature(null);
+    tooltip.classed("hidden", true);
+});
+
+const viewportLoader = new ViewportLoader(workerPool, {
+    addLayer,
+    removeLayer,
+    onStatus: text => d3.select("#status").text(text)
+});
+
+// Browse a whole layer through its spatial index instead of loading one file
+async function browseLayer(layer) {
+    try {
+        const [west, south, east, north] = await viewportLoader.open(layer);
+        const bounds = combinedBounds();
+        fitProjection(bounds ? [
+            [Math.min(west, bounds[0][0]), Math.min(south, bounds[0][1])],
+            [Math.max(east, bounds[1][0]), Math.max(north, bounds[1][1])]
+        ] : [[west, south], [east, north]]);
+        svg.call(zoom.transform, d3.zoomIdentity);
+        await renderFeatures();
+        viewportLoader.update(viewBounds());
+    } catch (error) {
+        console.error("Error browsing layer:", error);
+        alert(`Error browsing ${layer}`);
+    }
+}
+
+d3.select("#browse-button").on("click", () => {
+    const layer = d3.select("#layer-select").property("value");
+    if (layer) {
+        browseLayer(layer);
+    }
+});
+
+d3.select("#render-mode").on("change", function() {
+    renderMode = this.value;
+    tooltip.classed("hidden", true);
+    renderFeatures();
+});
+
 function handleDragOver(event) {
     event.preventDefault();
     d3.select("#map").classed("dragging", true);
@@ -185,4 +521,5 @@ document.body.addEventListener("drop", function(event) {
 window.addEventListener("resize", () => {
     svg.attr("width", window.innerWidth)
        .attr("height", window.innerHeight);
+    canvasRenderer.resize(window.innerWidth, window.innerHeight);
 });
\ No newline at end of file
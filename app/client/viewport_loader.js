@@ -0,0 +1,146 @@
+// Browses a layer made of many {base}.{geohash}.topojson files. The layer's
+// spatial index (/api/layers/{layer}/index) lists every file with its bounds;
+// on each view change only the files intersecting the view are fetched,
+// requests for files that scrolled out of view are aborted, and loaded
+// files outside the view are evicted once the memory budget is exceeded.
+//
+// The worker pool bounds how many files are fetched and decoded at once.
+class ViewportLoader {
+    constructor(pool, {addLayer, removeLayer, onStatus, budgetBytes = 256 * 1024 * 1024, maxFiles = 64}) {
+        this.pool = pool;
+        this.addLayer = addLayer;
+        this.removeLayer = removeLayer;
+        this.onStatus = onStatus || (() => {});
+        this.budgetBytes = budgetBytes;
+        this.maxFiles = maxFiles;
+        this.layer = null;
+        this.entries = [];
+        this.loaded = new Map();
+        this.pending = new Map();
+        this.wanted = new Set();
+    }
+
+    get active() {
+        return this.layer !== null;
+    }
+
+    async open(layer) {
+        this.close();
+        const response = await fetch(`/api/layers/${layer}/index`);
+        if (!response.ok) throw new Error(`No spatial index for ${layer}`);
+        const index = await response.json();
+        this.layer = layer;
+        this.entries = index.files;
+        return this.extent();
+    }
+
+    close() {
+        this.pending.forEach(controller => controller.abort());
+        this.pending.clear();
+        this.loaded.forEach((_, filename) => this.removeLayer(this.layerId(filename)));
+        this.loaded.clear();
+        this.layer = null;
+        this.entries = [];
+        this.wanted = new Set();
+    }
+
+    layerId(filename) {
+        return `${this.layer}/${filename}`;
+    }
+
+    // [west, south, east, north] covering every file in the layer
+    extent() {
+        return this.entries.reduce((extent, {bounds}) => [
+            Math.min(extent[0], bounds.west), Math.min(extent[1], bounds.south),
+            Math.max(extent[2], bounds.east), Math.max(extent[3], bounds.north)
+        ], [Infinity, Infinity, -Infinity, -Infinity]);
+    }
+
+    visible(view) {
+        const [west, south, east, north] = view;
+        return this.entries.filter(({bounds}) =>
+            bounds.west <= east && bounds.east >= west &&
+            bounds.south <= north && bounds.north >= south);
+    }
+
+    update(view) {
+        if (!this.active) return;
+        const wanted = this.visible(view);
+        const wantedNames = new Set(wanted.map(entry => entry.filename));
+        this.wanted = wantedNames;
+
+        for (const [filename, controller] of this.pending) {
+            if (!wantedNames.has(filename)) {
+                controller.abort();
+                this.pending.delete(filename);
+            }
+        }
+
+        if (wanted.length > this.maxFiles) {
+            this.onStatus(`Zoom in to load ${this.layer} (${wanted.length} files in view)`);
+            return;
+        }
+
+        const now = performance.now();
+        wanted.forEach(entry => {
+            if (this.loaded.has(entry.filename)) {
+                this.loaded.get(entry.filename).lastUsed = now;
+            } else if (!this.pending.has(entry.filename)) {
+                this.load(entry);
+            }
+        });
+        this.evict(wantedNames);
+        this.reportStatus();
+    }
+
+    async load(entry) {
+        const controller = new AbortController();
+        const layer = this.layer;
+        this.pending.set(entry.filename, controller);
+        this.reportStatus();
+        try {
+            const packed = await this.pool.load({url: `/${layer}/${entry.filename}`}, null, controller.signal);
+            if (this.layer !== layer || controller.signal.aborted) return;
+
+            const bytes = packed.coords.byteLength + packed.ringOffsets.byteLength +
+                packed.partOffsets.byteLength + packed.featureOffsets.byteLength + packed.types.byteLength;
+            this.loaded.set(entry.filename, {bytes, lastUsed: performance.now(), entry});
+            await this.addLayer(this.layerId(entry.filename), packed);
+            this.evict(this.wanted);
+        } catch (error) {
+            if (error.name !== "AbortError") {
+                console.error(`Error loading ${entry.filename}:`, error);
+            }
+        } finally {
+            if (this.pending.get(entry.filename) === controller) {
+                this.pending.delete(entry.filename);
+            }
+            this.reportStatus();
+        }
+    }
+
+    // Drop least recently seen off-screen files until under budget
+    evict(wantedNames) {
+        let total = 0;
+        this.loaded.forEach(({bytes}) => total += bytes);
+        if (total <= this.budgetBytes) return;
+
+        const candidates = Array.from(this.loaded.entries())
+            .filter(([filename]) => !wantedNames.has(filename))
+            .sort((a, b) => a[1].lastUsed - b[1].lastUsed);
+        for (const [filename, {bytes}] of candidates) {
+            if (total <= this.budgetBytes) break;
+            this.removeLayer(this.layerId(filename));
+            this.loaded.delete(filename);
+            total -= bytes;
+        }
+    }
+
+    reportStatus() {
+        if (!this.active) return;
+        let total = 0;
+        this.loaded.forEach(({bytes}) => total += bytes);
+        this.onStatus(`${this.layer}: ${this.loaded.size} files loaded ` +
+            `(${(total / (1024 * 1024)).toFixed(1)}MB), ${this.pending.size} loading`);
+    }
+}
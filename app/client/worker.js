@@ -0,0 +1,339 @@
+// Fetches, parses and decodes TopoJSON off the main thread. Decoded geometry
+// is packed into typed arrays that are transferred back without copying:
+//
+//   coords           Float64Array  x0, y0, x1, y1, ...
+//   ringOffsets      Uint32Array   ring i spans points ringOffsets[i]..ringOffsets[i + 1]
+//   partOffsets      Uint32Array   part j spans rings partOffsets[j]..partOffsets[j + 1]
+//   featureOffsets   Uint32Array   feature k spans parts featureOffsets[k]..featureOffsets[k + 1]
+//   types            Uint8Array    GEOMETRY_POINT / GEOMETRY_LINE / GEOMETRY_POLYGON per feature
+//
+// A part is a polygon (outer ring plus holes), a line, or a single point.
+//
+// "project" tasks turn a packed layer into base screen coordinates for the
+// canvas renderer, together with its hit-test index (see projectLayer).
+importScripts("https://cdnjs.cloudflare.com/ajax/libs/topojson/3.0.2/topojson.min.js");
+importScripts("https://cdnjs.cloudflare.com/ajax/libs/d3/7.8.5/d3.min.js");
+
+const GEOMETRY_POINT = 0;
+const GEOMETRY_LINE = 1;
+const GEOMETRY_POLYGON = 2;
+
+async function readResponse(response, id) {
+    const total = Number(response.headers.get("Content-Length")) || 0;
+    if (!response.body || !total) {
+        return await response.text();
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    const chunks = [];
+    let loaded = 0;
+    while (true) {
+        const {done, value} = await reader.read();
+        if (done) break;
+        loaded += value.length;
+        chunks.push(decoder.decode(value, {stream: true}));
+        postMessage({id, type: "progress", stage: "file", percent: loaded / total * 100});
+    }
+    chunks.push(decoder.decode());
+    return chunks.join("");
+}
+
+function decodeProperties(topology, feature) {
+    const dictionaries = topology.dictionaries;
+    const properties = feature.properties || {};
+    if (!dictionaries) return properties;
+    for (const [column, values] of Object.entries(dictionaries)) {
+        const code = properties[column];
+        if (code !== null && code !== undefined) {
+            properties[column] = values[code];
+        }
+    }
+    return properties;
+}
+
+function geometryParts(geometry) {
+    switch (geometry && geometry.type) {
+        case "Point": return [GEOMETRY_POINT, [[[geometry.coordinates]]]];
+        case "MultiPoint": return [GEOMETRY_POINT, geometry.coordinates.map(p => [[p]])];
+        case "LineString": return [GEOMETRY_LINE, [[geometry.coordinates]]];
+        case "MultiLineString": return [GEOMETRY_LINE, geometry.coordinates.map(line => [line])];
+        case "Polygon": return [GEOMETRY_POLYGON, [geometry.coordinates]];
+        case "MultiPolygon": return [GEOMETRY_POLYGON, geometry.coordinates];
+        case "GeometryCollection": {
+            const parts = geometry.geometries.map(geometryParts);
+            const type = parts.length ? Math.max(...parts.map(p => p[0])) : GEOMETRY_LINE;
+            return [type, parts.flatMap(p => p[1])];
+        }
+        default: return [GEOMETRY_LINE, []];
+    }
+}
+
+function packFeatures(topology, id) {
+    const objectName = Object.keys(topology.objects)[0];
+    const collection = topojson.feature(topology, topology.objects[objectName]);
+    const features = collection.features || [collection];
+
+    let pointCount = 0, ringCount = 0, partCount = 0;
+    const decoded = features.map(feature => {
+        const [type, parts] = geometryParts(feature.geometry);
+        partCount += parts.length;
+        parts.forEach(rings => {
+            ringCount += rings.length;
+            rings.forEach(ring => pointCount += ring.length);
+        });
+        return [type, parts];
+    });
+
+    const coords = new Float64Array(pointCount * 2);
+    const ringOffsets = new Uint32Array(ringCount + 1);
+    const partOffsets = new Uint32Array(partCount + 1);
+    const featureOffsets = new Uint32Array(features.length + 1);
+    const types = new Uint8Array(features.length);
+    const ids = [];
+    const properties = [];
+    const bounds = [Infinity, Infinity, -Infinity, -Infinity];
+
+    let point = 0, ring = 0, part = 0;
+    decoded.forEach(([type, parts], index) => {
+        types[index] = type;
+        featureOffsets[index] = part;
+        parts.forEach(rings => {
+            partOffsets[part++] = ring;
+            rings.forEach(coordinates => {
+                ringOffsets[ring++] = point;
+                coordinates.forEach(([x, y]) => {
+                    coords[point * 2] = x;
+                    coords[point * 2 + 1] = y;
+                    if (x < bounds[0]) bounds[0] = x;
+                    if (y < bounds[1]) bounds[1] = y;
+                    if (x > bounds[2]) bounds[2] = x;
+                    if (y > bounds[3]) bounds[3] = y;
+                    point++;
+                });
+            });
+        });
+        ids.push(features[index].id);
+        properties.push(decodeProperties(topology, features[index]));
+
+        if (index % 1000 === 0) {
+            postMessage({id, type: "progress", stage: "parse", percent: 50 + index / features.length * 50});
+        }
+    });
+    featureOffsets[features.length] = part;
+    partOffsets[partCount] = ring;
+    ringOffsets[ringCount] = point;
+
+    return {
+        coords, ringOffsets, partOffsets, featureOffsets, types, ids, properties, bounds,
+        sidecar: topology.sidecar || null
+    };
+}
+
+// Segments are hit-tested in runs of this many points, each with its own box
+const CHUNK_POINTS = 32;
+// Children per node of the packed R-tree over feature boxes
+const NODE_SIZE = 16;
+
+// Packed Hilbert R-tree (after Flatbush). Level 0 holds the items sorted along
+// a Hilbert curve; each level above holds one box per NODE_SIZE children.
+// indices[n] is a feature index on level 0 and a child position above it.
+function buildIndex(boxes, count) {
+    let nodes = count, n = count;
+    const levelBounds = [n * 4];
+    do {
+        n = Math.ceil(n / NODE_SIZE);
+        nodes += n;
+        levelBounds.push(nodes * 4);
+    } while (n > 1);
+
+    const nodeBoxes = new Float32Array(nodes * 4);
+    const indices = new Uint32Array(nodes);
+    let minX = Infinity, minY = Infinity, maxX = -Infinity, maxY = -Infinity;
+    for (let i = 0; i < count; i++) {
+        if (!(boxes[i * 4] <= boxes[i * 4 + 2])) continue;
+        minX = Math.min(minX, boxes[i * 4]);
+        minY = Math.min(minY, boxes[i * 4 + 1]);
+        maxX = Math.max(maxX, boxes[i * 4 + 2]);
+        maxY = Math.max(maxY, boxes[i * 4 + 3]);
+    }
+    const scaleX = 65535 / ((maxX - minX) || 1), scaleY = 65535 / ((maxY - minY) || 1);
+    const hilbertValues = new Uint32Array(count);
+    for (let i = 0; i < count; i++) {
+        const x = Math.floor(scaleX * ((boxes[i * 4] + boxes[i * 4 + 2]) / 2 - minX));
+        const y = Math.floor(scaleY * ((boxes[i * 4 + 1] + boxes[i * 4 + 3]) / 2 - minY));
+        hilbertValues[i] = hilbert(x || 0, y || 0);
+    }
+    const order = Array.from({length: count}, (_, i) => i).sort((a, b) => hilbertValues[a] - hilbertValues[b]);
+    order.forEach((f, i) => {
+        nodeBoxes.set(boxes.subarray(f * 4, f * 4 + 4), i * 4);
+        indices[i] = f;
+    });
+
+    for (let level = 0, pos = 0, write = levelBounds[0]; level < levelBounds.length - 1; level++) {
+        const end = levelBounds[level];
+        while (pos < end) {
+            const child = pos;
+            let x0 = Infinity, y0 = Infinity, x1 = -Infinity, y1 = -Infinity;
+            for (let j = 0; j < NODE_SIZE && pos < end; j++, pos += 4) {
+                // Unprojectable features have NaN boxes and are never matched
+                if (!(nodeBoxes[pos] <= nodeBoxes[pos + 2])) continue;
+                x0 = Math.min(x0, nodeBoxes[pos]);
+                y0 = Math.min(y0, nodeBoxes[pos + 1]);
+                x1 = Math.max(x1, nodeBoxes[pos + 2]);
+                y1 = Math.max(y1, nodeBoxes[pos + 3]);
+            }
+            nodeBoxes.set([x0, y0, x1, y1], write);
+            indices[write / 4] = child;
+            write += 4;
+        }
+    }
+    return {nodeBoxes, indices, levelBounds, count};
+}
+
+// Position of (x, y) along a Hilbert curve over a 2^16 grid
+function hilbert(x, y) {
+    let a = x ^ y, b = 0xFFFF ^ a, c = 0xFFFF ^ (x | y), d = x & (y ^ 0xFFFF);
+    let A = a | (b >> 1), B = (a >> 1) ^ a, C = ((c >> 1) ^ (b & (d >> 1))) ^ c, D = ((a & (c >> 1)) ^ (d >> 1)) ^ d;
+    a = A; b = B; c = C; d = D;
+    A = ((a & (a >> 2)) ^ (b & (b >> 2)));
+    B = ((a & (b >> 2)) ^ (b & ((a ^ b) >> 2)));
+    C ^= ((a & (c >> 2)) ^ (b & (d >> 2)));
+    D ^= ((b & (c >> 2)) ^ ((a ^ b) & (d >> 2)));
+    a = A; b = B; c = C; d = D;
+    A = ((a & (a >> 4)) ^ (b & (b >> 4)));
+    B = ((a & (b >> 4)) ^ (b & ((a ^ b) >> 4)));
+    C ^= ((a & (c >> 4)) ^ (b & (d >> 4)));
+    D ^= ((b & (c >> 4)) ^ ((a ^ b) & (d >> 4)));
+    a = A; b = B; c = C; d = D;
+    C ^= ((a & (c >> 8)) ^ (b & (d >> 8)));
+    D ^= ((b & (c >> 8)) ^ ((a ^ b) & (d >> 8)));
+    a = C ^ (C >> 1);
+    b = D ^ (D >> 1);
+    let i0 = x ^ y, i1 = b | (0xFFFF ^ (i0 | a));
+    i0 = (i0 | (i0 << 8)) & 0x00FF00FF;
+    i0 = (i0 | (i0 << 4)) & 0x0F0F0F0F;
+    i0 = (i0 | (i0 << 2)) & 0x33333333;
+    i0 = (i0 | (i0 << 1)) & 0x55555555;
+    i1 = (i1 | (i1 << 8)) & 0x00FF00FF;
+    i1 = (i1 | (i1 << 4)) & 0x0F0F0F0F;
+    i1 = (i1 | (i1 << 2)) & 0x33333333;
+    i1 = (i1 | (i1 << 1)) & 0x55555555;
+    return ((i1 << 1) | i0) >>> 0;
+}
+
+// Base screen coordinates for the canvas renderer, feature boxes for culling,
+// and the hit-test index: the R-tree finds features whose box holds the
+// cursor, and per-chunk boxes limit which of their segments are tested.
+// Chunk c covers points chunkStarts[c]..chunkEnds[c] (inclusive) of one ring;
+// feature f owns chunks featureChunks[f]..featureChunks[f + 1].
+function projectLayer(layer, params) {
+    const {coords, ringOffsets, partOffsets, featureOffsets, types} = layer;
+    const projection = d3.geoMercator()
+        .scale(params.scale).translate(params.translate).center(params.center).rotate(params.rotate);
+
+    const projected = new Float32Array(coords.length);
+    for (let i = 0; i < coords.length; i += 2) {
+        const point = projection([coords[i], coords[i + 1]]);
+        projected[i] = point ? point[0] : NaN;
+        projected[i + 1] = point ? point[1] : NaN;
+    }
+
+    const rings = ringOffsets.length - 1;
+    let chunkCount = 0;
+    for (let r = 0; r < rings; r++) {
+        const points = ringOffsets[r + 1] - ringOffsets[r];
+        chunkCount += points > 1 ? Math.ceil((points - 1) / CHUNK_POINTS) : points;
+    }
+    const chunkBoxes = new Float32Array(chunkCount * 4);
+    const chunkStarts = new Uint32Array(chunkCount);
+    const chunkEnds = new Uint32Array(chunkCount);
+    const featureChunks = new Uint32Array(types.length + 1);
+    const boxes = new Float32Array(types.length * 4);
+
+    let chunk = 0;
+    for (let f = 0; f < types.length; f++) {
+        featureChunks[f] = chunk;
+        let fx0 = Infinity, fy0 = Infinity, fx1 = -Infinity, fy1 = -Infinity;
+        for (let r = partOffsets[featureOffsets[f]]; r < partOffsets[featureOffsets[f + 1]]; r++) {
+            const ringStart = ringOffsets[r], ringEnd = ringOffsets[r + 1] - 1;
+            for (let start = ringStart; start <= ringEnd; start += CHUNK_POINTS) {
+                const end = Math.min(start + CHUNK_POINTS, ringEnd);
+                let x0 = Infinity, y0 = Infinity, x1 = -Infinity, y1 = -Infinity;
+                for (let i = start; i <= end; i++) {
+                    const x = projected[i * 2], y = projected[i * 2 + 1];
+                    if (x < x0) x0 = x;
+                    if (y < y0) y0 = y;
+                    if (x > x1) x1 = x;
+                    if (y > y1) y1 = y;
+                }
+                chunkBoxes.set([x0, y0, x1, y1], chunk * 4);
+                chunkStarts[chunk] = start;
+                chunkEnds[chunk] = end;
+                chunk++;
+                fx0 = Math.min(fx0, x0);
+                fy0 = Math.min(fy0, y0);
+                fx1 = Math.max(fx1, x1);
+                fy1 = Math.max(fy1, y1);
+                if (end === ringEnd) break;
+            }
+        }
+        boxes.set([fx0, fy0, fx1, fy1], f * 4);
+    }
+    featureChunks[types.length] = chunk;
+
+    return {projected, boxes, chunkBoxes, chunkStarts, chunkEnds, featureChunks, index: buildIndex(boxes, types.length)};
+}
+
+// In-flight fetches by task id, so a stale request can be aborted
+const controllers = new Map();
+
+onmessage = async (event) => {
+    const {id, url, file, type} = event.data;
+    if (type === "cancel") {
+        if (controllers.has(id)) controllers.get(id).abort();
+        return;
+    }
+    if (type === "project") {
+        try {
+            const result = projectLayer(event.data.layer, event.data.projection);
+            postMessage({id, type: "result", layer: result}, [
+                result.projected.buffer, result.boxes.buffer, result.chunkBoxes.buffer, result.chunkStarts.buffer,
+                result.chunkEnds.buffer, result.featureChunks.buffer, result.index.nodeBoxes.buffer,
+                result.index.indices.buffer
+            ]);
+        } catch (error) {
+            postMessage({id, type: "error", message: error.message});
+        }
+        return;
+    }
+
+    const controller = new AbortController();
+    controllers.set(id, controller);
+    try {
+        let text;
+        if (file) {
+            text = await file.text();
+        } else {
+            const response = await fetch(url, {signal: controller.signal});
+            if (!response.ok) throw new Error(`HTTP ${response.status} for ${url}`);
+            text = await readResponse(response, id);
+        }
+        if (controller.signal.aborted) throw new DOMException("Aborted", "AbortError");
+        postMessage({id, type: "progress", stage: "file", percent: 100});
+
+        const topology = JSON.parse(text);
+        postMessage({id, type: "progress", stage: "parse", percent: 50});
+
+        const layer = packFeatures(topology, id);
+        postMessage({id, type: "progress", stage: "parse", percent: 100});
+        postMessage({id, type: "result", layer}, [
+            layer.coords.buffer, layer.ringOffsets.buffer, layer.partOffsets.buffer,
+            layer.featureOffsets.buffer, layer.types.buffer
+        ]);
+    } catch (error) {
+        postMessage({id, type: "error", message: error.message, aborted: error.name === "AbortError"});
+    } finally {
+        controllers.delete(id);
+    }
+};
@@ -0,0 +1,136 @@
+import heapq
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import numpy as np
+
+from app.server.topology_merge import decode_arcs
+
+ALGORITHMS = ("dp", "vw")
+# Below this many arc vertices the pool costs more than it saves
+PARALLEL_MIN_POINTS = 200000
+
+
+def _min_points(arc) -> int:
+    # A closed arc is a whole ring on its own and must stay a valid ring
+    return 4 if len(arc) > 3 and arc[0] == arc[-1] else 2
+
+
+def _visvalingam(arc: List[List[float]], min_area: float) -> List[List[float]]:
+    """Visvalingam-Whyatt: repeatedly drop the vertex whose triangle with its
+    neighbours has the smallest area, until every remaining area is at least
+    min_area. Endpoints are always kept."""
+    n = len(arc)
+    keep = _min_points(arc)
+    if n <= keep:
+        return arc
+
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    removed = [False] * n
+
+    def triangle(i):
+        (ax, ay), (bx, by), (cx, cy) = arc[prev[i]], arc[i], arc[nxt[i]]
+        return abs((ax - cx) * (by - ay) - (ax - bx) * (cy - ay)) / 2
+
+    area = [math.inf] * n
+    for i in range(1, n - 1):
+        area[i] = triangle(i)
+    heap = [(area[i], i) for i in range(1, n - 1)]
+    heapq.heapify(heap)
+
+    remaining = n
+    while heap and remaining > keep:
+        value, i = heapq.heappop(heap)
+        if removed[i] or value != area[i]:
+            continue
+        if value >= min_area:
+            break
+        removed[i] = True
+        remaining -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                # Never let a neighbour's area drop below the one just removed,
+                # so points are eliminated in a consistent order
+                area[j] = max(triangle(j), value)
+                heapq.heappush(heap, (area[j], j))
+
+    return [point for i, point in enumerate(arc) if not removed[i]]
+
+
+def _douglas_peucker(arcs: List[List[List[float]]], tolerance: float) -> List[List[List[float]]]:
+    import shapely
+
+    arcs_2d = [arc if len(arc) > 1 else arc * 2 for arc in arcs]
+    coords = np.array([point for arc in arcs_2d for point in arc], dtype=np.float64)
+    lines = shapely.linestrings(coords, indices=np.repeat(np.arange(len(arcs_2d)), [len(a) for a in arcs_2d]))
+    simplified = shapely.simplify(lines, tolerance, preserve_topology=True)
+    result = []
+    for arc, line in zip(arcs, simplified):
+        coords = shapely.get_coordinates(line).tolist()
+        result.append(coords if len(coords) >= _min_points(arc) else arc)
+    return result
+
+
+def simplify_arcs(arcs: List[List[List[float]]], tolerance: float, algorithm: str = "dp") -> List[List[List[float]]]:
+    """Simplify a batch of arcs. Arc endpoints, where shared borders meet,
+    are never moved or removed.
+
+    `tolerance` is a distance for Douglas-Peucker; Visvalingam-Whyatt removes
+    points whose effective triangle is smaller than tolerance ** 2.
+    """
+    if algorithm == "dp":
+        return _douglas_peucker(arcs, tolerance)
+    if algorithm == "vw":
+        return [_visvalingam(arc, tolerance ** 2) for arc in arcs]
+    raise ValueError(f"Unknown simplify_algorithm {algorithm!r}, expected one of {ALGORITHMS}")
+
+
+def _simplify_chunk(args):
+    return simplify_arcs(*args)
+
+
+def _chunks(arcs: list, count: int) -> List[list]:
+    """Split arcs into contiguous chunks holding roughly equal vertex counts."""
+    total = sum(len(arc) for arc in arcs)
+    target = max(1, total // count)
+    chunks, current, size = [], [], 0
+    for arc in arcs:
+        current.append(arc)
+        size += len(arc)
+        if size >= target:
+            chunks.append(current)
+            current, size = [], 0
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def simplify_topology(topo: dict, tolerance: float, algorithm: str = "dp",
+                      workers: Optional[int] = None) -> dict:
+    """Simplify a topology's arcs in place, each arc once, so polygons that
+    share a border keep sharing exactly the same simplified line."""
+    if algorithm not in ALGORITHMS:
+        raise ValueError(f"Unknown simplify_algorithm {algorithm!r}, expected one of {ALGORITHMS}")
+    arcs = [[list(point) for point in arc] for arc in decode_arcs(topo)]
+    if not arcs:
+        return topo
+
+    workers = workers or os.cpu_count() or 1
+    points = sum(len(arc) for arc in arcs)
+    if workers > 1 and points >= PARALLEL_MIN_POINTS:
+        chunks = _chunks(arcs, workers * 4)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            simplified = [arc for chunk in executor.map(
+                _simplify_chunk, [(chunk, tolerance, algorithm) for chunk in chunks]) for arc in chunk]
+    else:
+        simplified = simplify_arcs(arcs, tolerance, algorithm)
+
+    # Arcs are written back unquantized; drop any transform they were encoded with
+    topo['arcs'] = simplified
+    topo.pop('transform', None)
+    return topo
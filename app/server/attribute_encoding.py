@@ -0,0 +1,100 @@
+from typing import Dict, List, Optional, Tuple
+
+
+def read_columns(shp_file: str, columns: Optional[List[str]] = None,
+                 drop_columns: Optional[List[str]] = None,
+                 required: Optional[List[str]] = None) -> Optional[List[str]]:
+    """Work out which DBF fields to read; None means all of them."""
+    if not columns and not drop_columns:
+        return None
+
+    if columns:
+        keep = list(columns)
+    else:
+        import pyogrio
+        fields = pyogrio.read_info(shp_file)['fields']
+        keep = [f for f in fields if f not in drop_columns]
+
+    for column in required or []:
+        if column not in keep:
+            keep.append(column)
+    return keep
+
+
+def apply_dtypes(gdf, dtypes: Optional[Dict[str, str]]):
+    """Cast configured columns after the read. The DBF is still parsed at its
+    native types; this only narrows what joins, simplification and encoding
+    carry from here on."""
+    for column, dtype in (dtypes or {}).items():
+        if column in gdf.columns:
+            gdf[column] = gdf[column].astype(dtype)
+    return gdf
+
+
+def dictionary_encode(df, max_unique: int, columns: Optional[List[str]] = None) -> Tuple[object, Dict[str, list]]:
+    """Replace low-cardinality string columns with integer codes.
+
+    Returns the encoded frame and a {column: [values]} dictionary; a code is
+    the position of the value in its column's list. Missing values are left
+    as nulls.
+    """
+    dictionaries = {}
+    if max_unique <= 0:
+        return df, dictionaries
+
+    df = df.copy()
+    candidates = columns if columns is not None else [c for c in df.columns if c != 'geometry']
+    for column in candidates:
+        series = df[column]
+        if str(series.dtype) == 'category':
+            series = series.astype(object)
+        elif series.dtype.kind not in 'OSU' and str(series.dtype) != 'string':
+            continue
+
+        values = series.dropna()
+        uniques = values.unique()
+        # Only worth it when values actually repeat
+        if len(uniques) == 0 or len(uniques) > max_unique or len(uniques) * 2 > len(values):
+            continue
+
+        lookup = sorted(str(v) for v in uniques)
+        codes = {v: i for i, v in enumerate(lookup)}
+        df[column] = series.map(lambda v: None if v is None or v != v else codes[str(v)]).astype('Int32')
+        dictionaries[column] = lookup
+    return df, dictionaries
+
+
+def decode_properties(properties: Optional[dict], dictionaries: Dict[str, list]) -> Optional[dict]:
+    if not properties or not dictionaries:
+        return properties
+    decoded = dict(properties)
+    for column, lookup in dictionaries.items():
+        code = decoded.get(column)
+        if code is not None:
+            decoded[column] = lookup[code]
+    return decoded
+
+
+def dictionary_encode_properties(properties: List[Optional[dict]], max_unique: int) -> Tuple[List[Optional[dict]], Dict[str, list]]:
+    """dictionary_encode() for a list of feature property dicts."""
+    import pandas as pd
+
+    rows = [p or {} for p in properties]
+    df = pd.DataFrame(rows)
+    if df.empty:
+        return properties, {}
+    encoded, dictionaries = dictionary_encode(df, max_unique)
+    if not dictionaries:
+        return properties, {}
+
+    result = []
+    for row, original in zip(encoded[list(dictionaries)].itertuples(index=False), properties):
+        if original is None:
+            result.append(None)
+            continue
+        updated = dict(original)
+        for column, code in zip(dictionaries, row):
+            if column in updated:
+                updated[column] = None if pd.isna(code) else int(code)
+        result.append(updated)
+    return result, dictionaries
@@ -0,0 +1,75 @@
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.server.attribute_encoding import dictionary_encode, decode_properties
+
+# {base}.{geohash}.topojson keeps geometry and feature ids only; properties
+# go to {base}.{geohash}.attrs.json, one column per attribute indexed by id
+SIDECAR_SUFFIX = ".attrs.json"
+
+
+def sidecar_filename(geometry_filename: str) -> str:
+    base = geometry_filename[:-len('.topojson')] if geometry_filename.endswith('.topojson') else geometry_filename
+    return f"{base}{SIDECAR_SUFFIX}"
+
+
+def write_sidecar(df, path: str, max_unique: int = 0) -> None:
+    """Write a feature-ordered properties frame as a columnar sidecar."""
+    encoded, dictionaries = dictionary_encode(df, max_unique)
+    columns = {}
+    for column in encoded.columns:
+        series = encoded[column].astype(object)
+        columns[column] = series.where(series.notna(), None).tolist()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'count': len(encoded),
+            'columns': columns,
+            'dictionaries': dictionaries
+        }, f)
+    os.replace(tmp_path, path)
+
+
+def read_sidecar_properties(path: str) -> List[Dict[str, Any]]:
+    """Expand a sidecar back into one properties dict per feature id."""
+    with open(path, 'r') as f:
+        sidecar = json.load(f)
+    names = list(sidecar['columns'])
+    rows = zip(*(sidecar['columns'][n] for n in names)) if names else ([] for _ in range(sidecar['count']))
+    return [decode_properties(dict(zip(names, row)), sidecar['dictionaries']) for row in rows]
+
+
+class SidecarReader:
+    """Serves properties for a handful of feature ids out of cached sidecars."""
+
+    def __init__(self, max_files: int = 64):
+        self.max_files = max_files
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def _load(self, path: str) -> Dict[str, Any]:
+        mtime = os.path.getmtime(path)
+        cached = self._cache.get(path)
+        if cached and cached['mtime'] == mtime:
+            self._cache.move_to_end(path)
+            return cached
+
+        with open(path, 'r') as f:
+            sidecar = json.load(f)
+        sidecar['mtime'] = mtime
+        self._cache[path] = sidecar
+        while len(self._cache) > self.max_files:
+            self._cache.popitem(last=False)
+        return sidecar
+
+    def get(self, path: str, ids: Iterable[int], columns: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        sidecar = self._load(path)
+        names = [c for c in (columns or sidecar['columns']) if c in sidecar['columns']]
+        result = {}
+        for feature_id in ids:
+            if 0 <= feature_id < sidecar['count']:
+                row = {c: sidecar['columns'][c][feature_id] for c in names}
+                result[feature_id] = decode_properties(row, sidecar['dictionaries'])
+        return result
@@ -0,0 +1,237 @@
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from ftplib import FTP, error_perm
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.server.config.tiger_config import TigerConfig
+
+# Snapshot of the remote tree, cached under the output directory
+CATALOG_FILE = "catalog.json"
+# processed_files.csv times are UTC, like MLSD modify facts (RFC 3659), so
+# the two compare directly. Rows written before this have no trailing Z and
+# are in the local time of the machine that wrote them.
+LOG_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+LEGACY_LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+NEVER = datetime.min.replace(tzinfo=timezone.utc)
+
+
+class CatalogError(RuntimeError):
+    """Listing failed for some layers; `failed` maps each to its error."""
+
+    def __init__(self, failed: Dict[str, str]):
+        super().__init__(failed)
+        self.failed = failed
+
+    def __str__(self) -> str:
+        return "Could not list " + "; ".join(f"{layer}: {error}" for layer, error in self.failed.items())
+
+
+def log_timestamp() -> str:
+    return time.strftime(LOG_TIME_FORMAT, time.gmtime())
+
+
+def parse_log_time(text: str) -> datetime:
+    if text.endswith('Z'):
+        return datetime.strptime(text, LOG_TIME_FORMAT).replace(tzinfo=timezone.utc)
+    return datetime.strptime(text, LEGACY_LOG_TIME_FORMAT).astimezone(timezone.utc)
+
+
+def _remote_time(text: str) -> datetime:
+    modified = datetime.fromisoformat(text)
+    # Catalogs cached before times were stored with an offset hold naive UTC
+    return modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+
+
+def load_processed_log(log_file: str) -> Dict[Tuple[str, str], datetime]:
+    """Last successful processing time (UTC) for each (directory, filename)."""
+    processed = {}
+    if not os.path.exists(log_file):
+        return processed
+    try:
+        with open(log_file, 'r') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) >= 4 and row[2] == 'success':
+                    try:
+                        processed[(row[0], row[1])] = parse_log_time(row[3])
+                    except ValueError:
+                        processed[(row[0], row[1])] = NEVER
+    except Exception as e:
+        logging.error(f"Error reading processed files log: {str(e)}")
+    return processed
+
+
+class RemoteCatalog:
+    """Parallel listing of the enabled layer directories on the Census FTP
+    server, with file sizes and modification times, cached locally for
+    `catalog_ttl` seconds."""
+
+    def __init__(self, config: TigerConfig):
+        self.config = config
+        self.cache_path = os.path.join(config.processing.output_dir, CATALOG_FILE)
+        self._local = threading.local()
+        self._connections: List[FTP] = []
+        self._lock = threading.Lock()
+
+    def _ftp(self) -> FTP:
+        # One connection per listing thread, reused across directories
+        ftp = getattr(self._local, 'ftp', None)
+        if ftp is None:
+            ftp = FTP(self.config.servers.ftp_host, timeout=self.config.processing.timeout)
+            ftp.login()
+            self._local.ftp = ftp
+            with self._lock:
+                self._connections.append(ftp)
+        return ftp
+
+    def _close(self):
+        for ftp in self._connections:
+            try:
+                ftp.quit()
+            except:
+                pass
+        self._connections = []
+        self._local = threading.local()
+
+    def _list_layer(self, layer: str) -> List[Dict[str, Any]]:
+        ftp = self._ftp()
+        path = f"{self.config.servers.base_path}/{layer}"
+        files = []
+        try:
+            for name, facts in ftp.mlsd(path, facts=['type', 'size', 'modify']):
+                if facts.get('type') == 'file' and name.endswith('.zip'):
+                    modify = facts.get('modify')
+                    files.append({
+                        'name': name,
+                        'size': int(facts['size']) if 'size' in facts else None,
+                        'modify': datetime.strptime(modify[:14], '%Y%m%d%H%M%S').replace(
+                            tzinfo=timezone.utc).isoformat() if modify else None
+                    })
+        except error_perm:
+            # Servers without MLSD: fall back to a Unix-style LIST
+            lines = []
+            ftp.dir(path, lines.append)
+            for line in lines:
+                parts = line.split(None, 8)
+                if len(parts) == 9 and parts[8].endswith('.zip'):
+                    files.append({'name': parts[8], 'size': int(parts[4]), 'modify': None})
+        files.sort(key=lambda f: f['name'])
+        return files
+
+    def snapshot(self, layers: List[str]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+        """Files per layer, and the error for each layer that could not be listed."""
+        workers = max(1, min(self.config.processing.catalog_workers, len(layers) or 1))
+        print(f"Listing {len(layers)} layers with {workers} connections...")
+        started = time.time()
+        listing = {}
+        failed = {}
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {layer: executor.submit(self._list_layer, layer) for layer in layers}
+                for layer, future in futures.items():
+                    try:
+                        listing[layer] = future.result()
+                    except Exception as e:
+                        logging.error(f"Error listing {layer}: {str(e)}")
+                        print(f"Error listing {layer}: {str(e)}")
+                        failed[layer] = str(e)
+        finally:
+            self._close()
+        print(f"Listed {sum(len(f) for f in listing.values()):,} files in {time.time() - started:.1f}s")
+        return listing, failed
+
+    def _read_cache(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.cache_path):
+            return None
+        try:
+            with open(self.cache_path, 'r') as f:
+                catalog = json.load(f)
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable catalog cache: {str(e)}")
+            return None
+        if catalog.get('base_path') != self.config.servers.base_path:
+            return None
+        return catalog
+
+    def _write_cache(self, catalog: Dict[str, Any]):
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def cached(self) -> Optional[Dict[str, Any]]:
+        """The cached catalog however old it is, without listing the server."""
+        return self._read_cache()
+
+    def load(self, refresh: bool = False, layers: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Return the catalog for `layers` (default: every enabled layer),
+        listing only those whose cached entry is missing or older than the TTL.
+        Raises CatalogError if any of them could not be listed."""
+        layers = [name for name in self.config.layers
+                  if self.config.is_layer_enabled(name) and (layers is None or name in layers)]
+        catalog = self._read_cache() or {'base_path': self.config.servers.base_path, 'layers': {}}
+        now = time.time()
+        ttl = self.config.processing.catalog_ttl
+
+        stale = [
+            layer for layer in layers
+            if refresh or layer not in catalog['layers'] or now - catalog['layers'][layer]['listed'] > ttl
+        ]
+        if stale:
+            listing, failed = self.snapshot(stale)
+            for layer, files in listing.items():
+                catalog['layers'][layer] = {'listed': now, 'files': files}
+            self._write_cache(catalog)
+            # A layer that could not be listed must not look like one with nothing to do
+            if failed:
+                raise CatalogError(failed)
+        else:
+            print(f"Using cached catalog {self.cache_path}")
+        return catalog
+
+
+def build_plan(catalog: Dict[str, Any], processed: Dict[Tuple[str, str], datetime],
+               config: TigerConfig) -> Dict[str, Dict[str, Any]]:
+    """Diff the catalog against the processed files log.
+
+    A file is pending when it has never been processed successfully, or when
+    the server reports it was modified after the last successful run.
+    """
+    plan = {}
+    for layer, entry in catalog['layers'].items():
+        if not config.is_layer_enabled(layer):
+            continue
+        pending = []
+        for remote in entry['files']:
+            last_run = processed.get((layer, remote['name']))
+            if last_run is None:
+                pending.append(dict(remote, reason='new'))
+            elif remote.get('modify') and _remote_time(remote['modify']) > last_run:
+                pending.append(dict(remote, reason='modified'))
+        plan[layer] = {
+            'layer_type': config.get_layer_config(layer).layer_type,
+            'total_files': len(entry['files']),
+            'pending': pending,
+            'pending_bytes': sum(f['size'] or 0 for f in pending)
+        }
+    return plan
+
+
+def print_plan(plan: Dict[str, Dict[str, Any]]):
+    print(f"\n{'Layer':<24}{'Type':<14}{'Pending':>10}{'Total':>10}{'Pending MB':>14}")
+    total_files = total_bytes = 0
+    for layer in sorted(plan):
+        entry = plan[layer]
+        total_files += len(entry['pending'])
+        total_bytes += entry['pending_bytes']
+        print(f"{layer:<24}{entry['layer_type']:<14}{len(entry['pending']):>10,}"
+              f"{entry['total_files']:>10,}{entry['pending_bytes'] / (1024 * 1024):>14,.1f}")
+    print(f"\n{total_files:,} files ({total_bytes / (1024 * 1024):,.1f}MB) to download")
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, List
+from typing import Optional, List, Dict, Any
 
 @dataclass
 class LayerConfig:
@@ -10,4 +10,21 @@ class LayerConfig:
     geometry_type: Optional[str] = None
     tolerance: Optional[float] = None
     skip_patterns: List[str] = None
-    custom_processor: Optional[str] = None
\ No newline at end of file
+    custom_processor: Optional[str] = None
+    # Attributes joined from ingested relationship tables, e.g.
+    # {'table': 'FEATNAMES', 'key': 'TLID', 'columns': ['FULLNAME']}
+    joins: List[Dict[str, Any]] = None
+    # Attribute projection: keep only `columns`, or everything except
+    # `drop_columns`. dtypes maps column -> pandas dtype, e.g. float32,
+    # cast after the read.
+    columns: List[str] = None
+    drop_columns: List[str] = None
+    dtypes: Dict[str, str] = None
+    # "inline" keeps properties on each feature; "sidecar" writes geometry
+    # with feature ids only and properties to a separate .attrs.json file
+    attribute_mode: str = "inline"
+    # "feature" simplifies each geometry before the topology is built;
+    # "arc" builds the topology first and simplifies each shared arc once,
+    # with Douglas-Peucker ("dp") or Visvalingam-Whyatt ("vw")
+    simplify_mode: str = "feature"
+    simplify_algorithm: str = "dp"
\ No newline at end of file
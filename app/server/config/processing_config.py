@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import List, Optional
 
 @dataclass
 class ProcessingConfig:
@@ -7,4 +8,15 @@ class ProcessingConfig:
     parallel_downloads: int = 4
     max_retries: int = 3
     timeout: int = 300
-
+    dictionary_max_unique: int = 1024
+    merge_outputs: bool = False
+    merge_precision: float = 0.000001
+    merge_region_precision: int = 0
+    merge_workers: Optional[int] = None
+    simplify_workers: Optional[int] = None
+    catalog_ttl: int = 86400
+    catalog_workers: int = 8
+    job_workers: int = 1
+    job_nice: int = 10
+    hot_layers: List[str] = None
+    shared_cache_bytes: int = 256 * 1024 * 1024
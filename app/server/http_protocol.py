@@ -0,0 +1,20 @@
+import socket
+
+from uvicorn.protocols.http.auto import AutoHTTPProtocol
+
+
+class NoDelayHTTPProtocol(AutoHTTPProtocol):
+    """uvicorn's default HTTP protocol with Nagle's algorithm disabled.
+
+    With --workers > 1, uvicorn binds the listening socket itself with
+    proto=0, and asyncio only sets TCP_NODELAY on accepted sockets whose
+    proto is IPPROTO_TCP. Keep-alive responses written in two parts then wait
+    for the client's delayed ACK, about 40ms each. Select this protocol with
+    --http app.server.http_protocol:NoDelayHTTPProtocol.
+    """
+
+    def connection_made(self, transport):
+        sock = transport.get_extra_info('socket')
+        if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        super().connection_made(transport)
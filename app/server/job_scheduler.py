@@ -0,0 +1,529 @@
+import asyncio
+import fcntl
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.server.config.tiger_config import TigerConfig
+
+# Layers served within this many seconds count as hot and jump the queue
+HOT_WINDOW = 300
+# Finished jobs kept for GET /jobs/{id}
+MAX_FINISHED_JOBS = 200
+MAX_JOB_EVENTS = 500
+# Job state shared by every server worker, kept next to the data it produces
+JOBS_DIR = ".jobs"
+# Followers poll job files, and the leader polls submissions, this often
+POLL_INTERVAL = 0.5
+# How often a follower tries to take over from a leader that has exited
+LEADER_RETRY = 5
+# How often a follower writes out the layers it served, for hotness
+HITS_INTERVAL = 5
+
+# Set in each worker process by _init_worker
+_events = None
+
+
+def _init_worker(events, nice: int):
+    global _events
+    _events = events
+    if nice and hasattr(os, 'nice'):
+        os.nice(nice)
+
+
+def _write_json(path: str, value):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[Any]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _run_job(config_path: str, output_dir: str, job_id: str, layer: str,
+             files: Optional[List[str]], force: bool, refresh_catalog: bool) -> Dict[str, Any]:
+    # Runs in a worker process, so geometry work never holds the server's GIL
+    from app.server.catalog import CatalogError
+    from app.server.tiger_processor import TigerProcessor
+
+    processor = TigerProcessor(config_path, output_dir=output_dir,
+                               progress=lambda event: _events.put((job_id, event)))
+    try:
+        if files is None:
+            try:
+                summaries = asyncio.run(processor.process_all(refresh_catalog=refresh_catalog, layers=[layer]))
+            except CatalogError as e:
+                return {'layer': layer, 'processed': 0, 'skipped': 0, 'failed': [], 'errors': e.failed}
+            return summaries.get(layer, {'layer': layer, 'processed': 0, 'skipped': 0, 'failed': []})
+        return asyncio.run(processor.process_files(layer, files, force=files if force else ()))
+    finally:
+        processor.close()
+        # Marks the end of this job's events
+        _events.put((job_id, None))
+
+
+@dataclass
+class Job:
+    id: str
+    layer: str
+    files: Optional[List[str]]
+    priority: int
+    force: bool = False
+    refresh_catalog: bool = False
+    sequence: int = 0
+    status: str = "queued"
+    created: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    progress: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    events: List[Dict[str, Any]] = field(default_factory=list)
+    seq: int = 0
+    saved: float = 0.0
+    subscribers: List[asyncio.Queue] = field(default_factory=list)
+    drained: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "partial", "failed")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'layer': self.layer,
+            'files': self.files,
+            'priority': self.priority,
+            'force': self.force,
+            'refresh_catalog': self.refresh_catalog,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(**{k: v for k, v in data.items() if k != 'events'})
+        job.events = data.get('events', [])
+        return job
+
+
+class JobScheduler:
+    """Prioritized queue of layer/file processing jobs run by a bounded pool
+    of worker processes.
+
+    Jobs are ordered by (not hot, priority, submission order); a layer is hot
+    if it is listed in `hot_layers` or was served in the last HOT_WINDOW
+    seconds. Only one job per layer runs at a time, since jobs for the same
+    layer share its output directory and spatial index.
+
+    Every server worker creates a scheduler, but only the one holding the
+    leader lock in JOBS_DIR runs jobs. Followers hand submissions to it
+    through JOBS_DIR/queue and read job state from the files it writes there,
+    so any worker can answer any job request.
+    """
+
+    def __init__(self, config_path: str, output_dir: str):
+        self.config_path = config_path
+        self.output_dir = output_dir
+        self.config = TigerConfig(config_path)
+        self.workers = max(1, self.config.processing.job_workers)
+        self.jobs_dir = os.path.join(output_dir, JOBS_DIR)
+        self.queue_dir = os.path.join(self.jobs_dir, "queue")
+        self.hits_dir = os.path.join(self.jobs_dir, "hits")
+        self.leader = False
+        self.jobs: Dict[str, Job] = {}
+        self.last_served: Dict[str, float] = {}
+        self._aliases: Dict[str, str] = {}
+        self._queued: List[Job] = []
+        self._running_layers = set()
+        self._sequence = itertools.count()
+        self._tasks: List[asyncio.Task] = []
+        self._executor = None
+        self._events = None
+        self._drain = None
+        self._changed = None
+        self._loop = None
+        self._leader_lock = None
+        self._hits_written = 0.0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        os.makedirs(self.queue_dir, exist_ok=True)
+        os.makedirs(self.hits_dir, exist_ok=True)
+        if self._take_leadership():
+            self._lead()
+        else:
+            self._tasks.append(asyncio.create_task(self._retry_leadership()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor:
+            # Running jobs stop with the server. Outputs are only ever replaced
+            # whole, and the next leader marks these jobs failed.
+            for process in list((getattr(self._executor, '_processes', None) or {}).values()):
+                process.terminate()
+            await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+            self._executor = None
+        if self._events:
+            self._events.put(None)
+            await asyncio.to_thread(self._drain.join)
+            self._events.close()
+            self._events.join_thread()
+            # Dropping the last reference unlinks the queue's semaphores
+            self._events = None
+        if self._leader_lock:
+            self._leader_lock.close()
+
+    def _take_leadership(self) -> bool:
+        lock = open(os.path.join(self.jobs_dir, "leader.lock"), 'a')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock.close()
+            return False
+        # Held until this process exits
+        self._leader_lock = lock
+        self.leader = True
+        return True
+
+    async def _retry_leadership(self):
+        while not self._take_leadership():
+            await asyncio.sleep(LEADER_RETRY)
+        self._lead()
+
+    def _lead(self):
+        logging.info(f"Running processing jobs in worker {os.getpid()}")
+        self._changed = asyncio.Condition()
+        self._recover()
+        context = multiprocessing.get_context('spawn')
+        self._events = context.Queue()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=context,
+            initializer=_init_worker, initargs=(self._events, self.config.processing.job_nice))
+        self._drain = threading.Thread(target=self._drain_events, daemon=True)
+        self._drain.start()
+        self._tasks.extend(asyncio.create_task(self._worker()) for _ in range(self.workers))
+        self._tasks.append(asyncio.create_task(self._poll_submissions()))
+
+    def _recover(self):
+        # Jobs left by a previous leader: queued ones run here, running ones were lost
+        for data in sorted(self._read_jobs(), key=lambda d: d['created']):
+            job = Job.from_dict(data)
+            if job.status == "queued":
+                job.sequence = next(self._sequence)
+                self._queued.append(job)
+            elif job.status == "running":
+                job.status = "failed"
+                job.error = "Server stopped while the job was running"
+                job.finished = time.time()
+                self._save(job)
+            self.jobs[job.id] = job
+
+    def record_hit(self, layer: str):
+        now = time.time()
+        self.last_served[layer] = now
+        if self._loop and not self.leader and now - self._hits_written > HITS_INTERVAL:
+            self._hits_written = now
+            try:
+                _write_json(os.path.join(self.hits_dir, f"{os.getpid()}.json"), self.last_served)
+            except OSError as e:
+                logging.warning(f"Could not record served layers: {str(e)}")
+
+    def _merge_hits(self):
+        for name in os.listdir(self.hits_dir):
+            path = os.path.join(self.hits_dir, name)
+            if not name.endswith('.json'):
+                continue
+            try:
+                if time.time() - os.path.getmtime(path) > HOT_WINDOW:
+                    # Left by a worker that has stopped serving
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            for layer, served in (_read_json(path) or {}).items():
+                self.last_served[layer] = max(served, self.last_served.get(layer, 0))
+
+    def is_hot(self, layer: str) -> bool:
+        if layer in (self.config.processing.hot_layers or []):
+            return True
+        served = self.last_served.get(layer)
+        return served is not None and time.time() - served < HOT_WINDOW
+
+    def _order(self, job: Job):
+        return (not self.is_hot(job.layer), job.priority, job.sequence)
+
+    async def submit(self, layer: str, files: Optional[List[str]] = None, priority: int = 10,
+                     force: bool = False, refresh_catalog: bool = False) -> Job:
+        if not self.config.is_layer_enabled(layer):
+            raise KeyError(f"Layer not enabled: {layer}")
+
+        job = Job(id=uuid.uuid4().hex[:12], layer=layer, files=files, priority=priority,
+                  force=force, refresh_catalog=refresh_catalog)
+        if self.leader:
+            return await self._enqueue(job)
+        # Saved first so any worker can answer for the job at once
+        self._save(job)
+        _write_json(os.path.join(self.queue_dir, f"{job.id}.json"), job.to_dict())
+        logging.info(f"Submitted job {job.id} for {layer}")
+        return job
+
+    async def _enqueue(self, job: Job) -> Job:
+        async with self._changed:
+            # Resubmitting queued work raises its priority instead of duplicating it
+            for queued in self._queued:
+                if queued.layer == job.layer and queued.files == job.files and queued.force == job.force:
+                    queued.priority = min(queued.priority, job.priority)
+                    self._save(queued)
+                    return queued
+
+            job.sequence = next(self._sequence)
+            self.jobs[job.id] = job
+            self._queued.append(job)
+            self._save(job)
+            self._changed.notify_all()
+        logging.info(f"Queued job {job.id} for {job.layer}")
+        return job
+
+    async def _poll_submissions(self):
+        while True:
+            submissions = []
+            for name in os.listdir(self.queue_dir):
+                path = os.path.join(self.queue_dir, name)
+                if name.endswith('.json'):
+                    data = _read_json(path)
+                    os.remove(path)
+                    if data is not None:
+                        submissions.append(data)
+            for data in sorted(submissions, key=lambda d: d['created']):
+                job = await self._enqueue(Job.from_dict(data))
+                if job.id != data['id']:
+                    # The follower already answered with its own id
+                    self._aliases[data['id']] = job.id
+                    _write_json(self._job_path(data['id']), {'alias': job.id})
+            self._merge_hits()
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job: Job):
+        job.saved = time.time()
+        _write_json(self._job_path(job.id), dict(job.to_dict(), events=job.events))
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not job_id.isalnum():
+            return None
+        data = _read_json(self._job_path(job_id))
+        if data is not None and 'alias' in data:
+            data = _read_json(self._job_path(data['alias']))
+        return data
+
+    def _read_jobs(self) -> List[Dict[str, Any]]:
+        jobs = []
+        for name in os.listdir(self.jobs_dir):
+            if name.endswith('.json'):
+                data = _read_json(os.path.join(self.jobs_dir, name))
+                if data is not None and 'id' in data:
+                    jobs.append(data)
+        return jobs
+
+    def get(self, job_id: str) -> Optional[Job]:
+        job = self.jobs.get(self._aliases.get(job_id, job_id))
+        if job is not None:
+            return job
+        data = self._load(job_id)
+        if data is None:
+            return None
+        return self.jobs.get(data['id']) or Job.from_dict(data)
+
+    def list_jobs(self) -> List[Job]:
+        if self.leader:
+            jobs = list(self.jobs.values())
+        else:
+            jobs = [Job.from_dict(data) for data in self._read_jobs()]
+        return sorted(jobs, key=lambda j: j.created, reverse=True)
+
+    async def _next_job(self) -> Job:
+        async with self._changed:
+            while True:
+                runnable = [j for j in self._queued if j.layer not in self._running_layers]
+                if runnable:
+                    job = min(runnable, key=self._order)
+                    self._queued.remove(job)
+                    self._running_layers.add(job.layer)
+                    return job
+                await self._changed.wait()
+
+    async def _worker(self):
+        while True:
+            job = await self._next_job()
+            job.status = "running"
+            job.started = time.time()
+            self._publish(job, {'stage': 'job', 'status': 'running'})
+            try:
+                job.result = await self._loop.run_in_executor(
+                    self._executor, _run_job, self.config_path, self.output_dir, job.id,
+                    job.layer, job.files, job.force, job.refresh_catalog)
+                failed = job.result.get('failed') or []
+                errors = job.result.get('errors')
+                if errors:
+                    job.status = "failed"
+                    job.error = "; ".join(f"Could not list {layer}: {error}" for layer, error in errors.items())
+                elif not failed:
+                    job.status = "done"
+                elif job.result.get('processed'):
+                    job.status = "partial"
+                else:
+                    job.status = "failed"
+                    job.error = f"All {len(failed)} files failed"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Job {job.id} for {job.layer} failed: {str(e)}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                # Let progress still in flight from the worker land before the final event
+                try:
+                    await asyncio.wait_for(job.drained.wait(), 5)
+                except asyncio.TimeoutError:
+                    pass
+                job.finished = time.time()
+                async with self._changed:
+                    self._running_layers.discard(job.layer)
+                    self._changed.notify_all()
+            if job.error:
+                self._publish(job, {'stage': 'error', 'error': job.error})
+            self._publish(job, {'stage': 'job', 'status': job.status, 'result': job.result, 'error': job.error})
+            self._close_streams(job)
+            self._prune()
+
+    def _drain_events(self):
+        # Worker processes report progress through a queue; hand each event to the loop
+        while True:
+            item = self._events.get()
+            if item is None:
+                return
+            job_id, event = item
+            self._loop.call_soon_threadsafe(self._on_event, job_id, event)
+
+    def _on_event(self, job_id: str, event: Dict[str, Any]):
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+        if event is None:
+            job.drained.set()
+        else:
+            self._publish(job, event)
+
+    def _publish(self, job: Job, event: Dict[str, Any]):
+        job.seq += 1
+        event = dict(event, job=job.id, time=time.time(), seq=job.seq)
+        if event['stage'] == 'download':
+            job.progress = event
+        else:
+            job.events.append(event)
+            del job.events[:-MAX_JOB_EVENTS]
+        for queue in job.subscribers:
+            queue.put_nowait(event)
+        # Download progress is frequent; followers only need it every poll
+        if event['stage'] != 'download' or event['time'] - job.saved >= POLL_INTERVAL:
+            self._save(job)
+
+    def _close_streams(self, job: Job):
+        for queue in job.subscribers:
+            queue.put_nowait(None)
+
+    def _prune(self):
+        finished = sorted((j for j in self.jobs.values() if j.done), key=lambda j: j.finished)
+        for job in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[job.id]
+            self._remove(job.id)
+        for alias, job_id in list(self._aliases.items()):
+            if job_id not in self.jobs:
+                del self._aliases[alias]
+                self._remove(alias)
+
+    def _remove(self, job_id: str):
+        try:
+            os.remove(self._job_path(job_id))
+        except OSError:
+            pass
+
+    async def stream(self, job: Job, keepalive: float = 15) -> AsyncIterator[str]:
+        """Server-sent events for one job: a snapshot, the events so far,
+        then live events until the job finishes."""
+        if self.jobs.get(job.id) is not job:
+            # Another worker runs the job
+            async for message in self._follow(job, keepalive):
+                yield message
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        job.subscribers.append(queue)
+        history = list(job.events)
+        try:
+            yield f"event: snapshot\ndata: {json.dumps(job.to_dict())}\n\n"
+            for event in history:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+            if job.done:
+                return
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            job.subscribers.remove(queue)
+
+    async def _follow(self, job: Job, keepalive: float) -> AsyncIterator[str]:
+        # Same stream as above, polled from the job file the leader writes
+        yield f"event: snapshot\ndata: {json.dumps(job.to_dict())}\n\n"
+        seq = 0
+        for event in job.events:
+            yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+            seq = event.get('seq', seq)
+        progress = job.progress
+        idle = 0.0
+        while not job.done:
+            await asyncio.sleep(POLL_INTERVAL)
+            data = self._load(job.id)
+            if data is None:
+                return
+            job = Job.from_dict(data)
+            events = [e for e in job.events if e.get('seq', 0) > seq]
+            if job.progress and job.progress != progress:
+                progress = job.progress
+                events.insert(0, progress)
+            for event in events:
+                yield f"event: {event['stage']}\ndata: {json.dumps(event)}\n\n"
+                seq = max(seq, event.get('seq', 0))
+            idle = 0.0 if events else idle + POLL_INTERVAL
+            if idle >= keepalive:
+                idle = 0.0
+                yield ": keepalive\n\n"
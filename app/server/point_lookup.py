@@ -0,0 +1,177 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.server.attribute_encoding import decode_properties
+from app.server.attribute_sidecar import read_sidecar_properties
+from app.server.spatial_index import SPATIAL_INDEX_FILE
+from app.server.topology_merge import decode_arcs
+
+# Largest batch accepted by a single lookup
+MAX_POINTS = 100000
+
+
+def _ring(refs: List[int], arcs: List[List[Tuple[float, float]]]) -> List[Tuple[float, float]]:
+    ring = []
+    for ref in refs:
+        arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+        ring.extend(arc if not ring else arc[1:])
+    return ring
+
+
+def load_polygons(path: str) -> Tuple[list, List[Dict[str, Any]]]:
+    """Polygonal features of one TopoJSON output with their decoded properties."""
+    from shapely.geometry import MultiPolygon, Polygon
+
+    with open(path, 'r') as f:
+        topo = json.load(f)
+    arcs = decode_arcs(topo)
+
+    sidecar_properties = None
+    if topo.get('sidecar'):
+        sidecar_properties = read_sidecar_properties(
+            os.path.join(os.path.dirname(path), topo['sidecar']['file']))
+
+    geometries, properties = [], []
+    for obj in topo.get('objects', {}).values():
+        members = obj['geometries'] if obj.get('type') == 'GeometryCollection' else [obj]
+        for member in members:
+            if member.get('type') == 'Polygon':
+                polygons = [member['arcs']]
+            elif member.get('type') == 'MultiPolygon':
+                polygons = member['arcs']
+            else:
+                continue
+            parts = [Polygon(_ring(rings[0], arcs), [_ring(r, arcs) for r in rings[1:]])
+                     for rings in polygons if rings]
+            geometries.append(parts[0] if len(parts) == 1 else MultiPolygon(parts))
+
+            if sidecar_properties is not None and member.get('id') is not None:
+                properties.append(sidecar_properties[member['id']])
+            else:
+                properties.append(decode_properties(dict(member.get('properties') or {}),
+                                                    topo.get('dictionaries')))
+    return geometries, properties
+
+
+class LayerPolygons:
+    """Every polygon of a layer in one STRtree, ready for vectorized queries."""
+
+    def __init__(self, layer_dir: str):
+        import shapely
+        from shapely import STRtree
+
+        geometries, properties = [], []
+        for filename in sorted(os.listdir(layer_dir)):
+            if filename.endswith('.topojson'):
+                file_geometries, file_properties = load_polygons(os.path.join(layer_dir, filename))
+                geometries.extend(file_geometries)
+                properties.extend(file_properties)
+
+        self.geometries = np.array(geometries, dtype=object)
+        self.properties = properties
+        shapely.prepare(self.geometries)
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self) -> int:
+        return len(self.properties)
+
+    def query(self, lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+        """Index of the polygon containing each point, or -1. Points on a
+        shared border resolve to the first polygon that touches them."""
+        import shapely
+
+        # Bounding-box candidates, then one vectorized test against the
+        # prepared polygons (a predicate query would test point.intersects
+        # and never use them)
+        point_idx, polygon_idx = self.tree.query(shapely.points(lons, lats))
+        inside = shapely.intersects_xy(self.geometries[polygon_idx], lons[point_idx], lats[point_idx])
+        point_idx, polygon_idx = point_idx[inside], polygon_idx[inside]
+        matches = np.full(len(lons), -1, dtype=np.int64)
+        if len(point_idx):
+            first = np.unique(point_idx, return_index=True)[1]
+            matches[point_idx[first]] = polygon_idx[first]
+        return matches
+
+
+class PointLookup:
+    """Batch point-in-polygon lookups over processed polygon layers.
+
+    Layers are loaded on first use and kept in memory; a layer is reloaded
+    when its spatial index changes, i.e. when the processor has written a
+    new file to it.
+    """
+
+    def __init__(self, data_dir: str, max_layers: int = 8):
+        self.data_dir = data_dir
+        self.max_layers = max_layers
+        self._layers: "OrderedDict[str, Tuple[float, LayerPolygons]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def _version(self, layer_dir: str) -> float:
+        index_path = os.path.join(layer_dir, SPATIAL_INDEX_FILE)
+        return os.path.getmtime(index_path if os.path.exists(index_path) else layer_dir)
+
+    def layer(self, layer: str) -> LayerPolygons:
+        layer_dir = os.path.join(self.data_dir, layer)
+        if not os.path.isdir(layer_dir):
+            raise KeyError(f"Layer not found: {layer}")
+        version = self._version(layer_dir)
+
+        cached = self._layers.get(layer)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        # Loading one layer must not block lookups against the others
+        with self._lock:
+            loading = self._loading.setdefault(layer, threading.Lock())
+        with loading:
+            cached = self._layers.get(layer)
+            if cached and cached[0] == version:
+                return cached[1]
+
+            polygons = LayerPolygons(layer_dir)
+            if not len(polygons):
+                raise KeyError(f"Layer has no polygons: {layer}")
+            logging.info(f"Loaded {len(polygons):,} polygons for {layer}")
+            with self._lock:
+                self._layers[layer] = (version, polygons)
+                self._layers.move_to_end(layer)
+                while len(self._layers) > self.max_layers:
+                    self._layers.popitem(last=False)
+            return polygons
+
+    def lookup(self, points, layers: List[str],
+               columns: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Containing feature per point for each layer.
+
+        `points` is a sequence of (lon, lat) pairs. Each layer's result has
+        `index`, one entry per point pointing into `features` (-1 when no
+        polygon contains the point), so a feature matched by many points is
+        returned once.
+        """
+        coords = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        results = {}
+        for layer in layers:
+            polygons = self.layer(layer)
+            matches = polygons.query(coords[:, 0], coords[:, 1])
+            matched, index = np.unique(matches, return_inverse=True)
+            features = []
+            for polygon in matched:
+                if polygon < 0:
+                    continue
+                properties = polygons.properties[polygon]
+                if columns:
+                    properties = {c: properties.get(c) for c in columns}
+                features.append(properties)
+            # Shift codes down past the -1 slot when some points matched nothing
+            if len(matched) and matched[0] < 0:
+                index = index - 1
+            results[layer] = {'index': index.tolist(), 'features': features}
+        return results
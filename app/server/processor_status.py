@@ -0,0 +1,121 @@
+import csv
+import json
+import os
+from collections import defaultdict
+from typing import List
+
+from app.server.catalog import NEVER, RemoteCatalog, build_plan, load_processed_log, parse_log_time
+from app.server.config.tiger_config import TigerConfig
+from app.server.attribute_sidecar import SIDECAR_SUFFIX
+from app.server.relationship_store import RELATIONSHIPS_DIR
+from app.server.spatial_index import SPATIAL_INDEX_FILE, load_spatial_index
+
+# Read-only reports over the output directory. Nothing here connects to the
+# server or imports the geometry stack, so they are cheap to run from cron.
+
+
+def _latest_statuses(log_file: str) -> dict:
+    """Most recent status and timestamp for each (directory, filename)."""
+    latest = {}
+    if not os.path.exists(log_file):
+        return latest
+    with open(log_file, 'r') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if len(row) >= 4:
+                latest[(row[0], row[1])] = (row[2], row[3])
+    return latest
+
+
+def print_status(config: TigerConfig):
+    output_dir = config.processing.output_dir
+    log_file = os.path.join(output_dir, "processed_files.csv")
+    statuses = _latest_statuses(log_file)
+
+    catalog = RemoteCatalog(config).cached()
+    plan = build_plan(catalog, load_processed_log(log_file), config) if catalog else {}
+
+    counts = defaultdict(lambda: {'success': 0, 'error': 0, 'last': NEVER})
+    for (layer, _), (status, timestamp) in statuses.items():
+        entry = counts[layer]
+        entry['success' if status == 'success' else 'error'] += 1
+        try:
+            entry['last'] = max(entry['last'], parse_log_time(timestamp))
+        except ValueError:
+            pass
+
+    layers = [name for name in config.layers if config.is_layer_enabled(name)]
+    print(f"{'Layer':<24}{'Done':>8}{'Errors':>8}{'Pending':>9}{'Output MB':>12}  Last run (UTC)")
+    for layer in sorted(layers):
+        layer_dir = os.path.join(output_dir, layer)
+        size = 0
+        if os.path.isdir(layer_dir):
+            size = sum(os.path.getsize(os.path.join(layer_dir, f)) for f in os.listdir(layer_dir)
+                       if f.endswith('.topojson') or f.endswith(SIDECAR_SUFFIX))
+        pending = len(plan[layer]['pending']) if layer in plan else '?'
+        entry = counts[layer]
+        last = entry['last'].strftime('%Y-%m-%d %H:%M:%S') if entry['last'] > NEVER else '-'
+        print(f"{layer:<24}{entry['success']:>8,}{entry['error']:>8,}{pending:>9}"
+              f"{size / (1024 * 1024):>12,.1f}  {last}")
+
+    if catalog:
+        print(f"\nPending counts from {RemoteCatalog(config).cache_path}")
+    else:
+        print("\nNo cached catalog; run `plan` to list the server")
+
+
+def _verify_layer(layer_dir: str, quick: bool) -> List[str]:
+    problems = []
+    outputs = sorted(f for f in os.listdir(layer_dir) if f.endswith('.topojson'))
+    index = load_spatial_index(layer_dir)
+    if index is None:
+        if outputs:
+            problems.append(f"missing {SPATIAL_INDEX_FILE}")
+    else:
+        indexed = {entry['filename'] for entry in index['files']}
+        problems += [f"{name} not in {SPATIAL_INDEX_FILE}" for name in outputs if name not in indexed]
+        problems += [f"{SPATIAL_INDEX_FILE} lists missing {name}" for name in sorted(indexed - set(outputs))]
+
+    for name in outputs:
+        path = os.path.join(layer_dir, name)
+        if os.path.getsize(path) == 0:
+            problems.append(f"{name} is empty")
+            continue
+        if quick:
+            continue
+        try:
+            with open(path, 'r') as f:
+                topo = json.load(f)
+        except ValueError as e:
+            problems.append(f"{name} is not valid JSON: {str(e)}")
+            continue
+        if topo.get('type') != 'Topology' or not topo.get('objects'):
+            problems.append(f"{name} is not a TopoJSON topology")
+        sidecar = topo.get('sidecar')
+        if sidecar and not os.path.exists(os.path.join(layer_dir, sidecar['file'])):
+            problems.append(f"{name} references missing {sidecar['file']}")
+    return problems
+
+
+def verify_outputs(config: TigerConfig, quick: bool = False) -> int:
+    """Check every layer directory's outputs against its spatial index and,
+    unless quick, that each file parses as a topology. Returns the number of
+    problems found."""
+    output_dir = config.processing.output_dir
+    problems = 0
+    for layer in sorted(config.layers):
+        layer_config = config.get_layer_config(layer)
+        if layer_config.layer_type == "RELATIONSHIP":
+            layer_dir = os.path.join(output_dir, RELATIONSHIPS_DIR, layer)
+            found = [] if not os.path.isdir(layer_dir) or os.path.exists(
+                os.path.join(layer_dir, 'table', 'manifest.json')) else ["partitions not indexed"]
+        else:
+            layer_dir = os.path.join(output_dir, layer)
+            found = _verify_layer(layer_dir, quick) if os.path.isdir(layer_dir) else []
+        for problem in found:
+            print(f"{layer}: {problem}")
+        problems += len(found)
+
+    print(f"\n{problems} problem{'s' if problems != 1 else ''} found")
+    return problems
@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+import shutil
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+# Relationship tables live under {output_dir}/RELATIONSHIPS/{LAYER}/
+RELATIONSHIPS_DIR = "RELATIONSHIPS"
+
+# ID columns that get a sorted index when present in a table
+KEY_COLUMNS = ('TLID', 'TFID', 'ARID', 'LINEARID')
+
+
+def _partition_state(partition_dir: str) -> Dict[str, List[float]]:
+    return {
+        filename: [os.path.getsize(os.path.join(partition_dir, filename)),
+                   os.path.getmtime(os.path.join(partition_dir, filename))]
+        for filename in sorted(os.listdir(partition_dir)) if filename.endswith('.npz')
+    }
+
+
+class StringColumn:
+    """Variable-length UTF-8 strings: one byte blob plus row offsets into it,
+    so a column costs its actual text rather than rows x the longest value."""
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        self.offsets = offsets
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, rows) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, ends = self.offsets[rows].tolist(), self.offsets[rows + 1].tolist()
+        data = self.data
+        return np.array([bytes(data[s:e]).decode('utf-8') for s, e in zip(starts, ends)], dtype=object)
+
+
+class RelationshipStore:
+    """Columnar store for TIGER relationship tables (ADDR, FEATNAMES, FACES, ...).
+
+    Each ingested DBF becomes a partition. build_index() streams the
+    partitions of a layer, one at a time, into one file per column plus a
+    sorted key/row index per ID column, so batch lookups are a binary search
+    over memory-mapped arrays. Numeric columns are .npy arrays; string
+    columns are a UTF-8 blob with row offsets.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._tables: Dict[str, Dict[str, Any]] = {}
+
+    def _layer_dir(self, layer: str) -> str:
+        return os.path.join(self.root, layer)
+
+    def ingest(self, layer: str, name: str, dbf_path: str) -> int:
+        import geopandas as gpd
+
+        df = gpd.read_file(dbf_path, ignore_geometry=True)
+        partition_dir = os.path.join(self._layer_dir(layer), 'partitions')
+        os.makedirs(partition_dir, exist_ok=True)
+
+        columns = {}
+        for column in df.columns:
+            series = df[column]
+            if series.dtype.kind in 'biuf':
+                columns[column] = series.to_numpy()
+            else:
+                columns[column] = series.fillna('').astype(str).to_numpy(dtype=str)
+
+        np.savez_compressed(os.path.join(partition_dir, f"{name}.npz"), **columns)
+        logging.info(f"Ingested {len(df):,} rows from {name} into {layer}")
+        return len(df)
+
+    def build_index(self, layer: str) -> int:
+        layer_dir = self._layer_dir(layer)
+        partition_dir = os.path.join(layer_dir, 'partitions')
+        if not os.path.isdir(partition_dir):
+            raise FileNotFoundError(f"No partitions ingested for {layer}")
+        state = _partition_state(partition_dir)
+        if not state:
+            raise FileNotFoundError(f"No partitions ingested for {layer}")
+
+        manifest_path = os.path.join(layer_dir, 'table', 'manifest.json')
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r') as f:
+                current = json.load(f)
+            if current.get('partitions') == state:
+                logging.info(f"{layer} index is up to date ({current['rows']:,} rows)")
+                return current['rows']
+
+        # First pass: row counts, column types and key widths, holding one
+        # partition column in memory at a time
+        rows = 0
+        dtypes: Dict[str, list] = {}
+        key_width: Dict[str, int] = {}
+        for filename in state:
+            with np.load(os.path.join(partition_dir, filename)) as data:
+                for name in data.files:
+                    column = data[name]
+                    dtypes.setdefault(name, []).append(column.dtype)
+                    if name in KEY_COLUMNS and len(column):
+                        # In bytes, in case this key ends up stored as strings
+                        width = max(len(value.encode('utf-8')) for value in column.astype(str).tolist())
+                        key_width[name] = max(key_width.get(name, 1), width)
+                rows += len(column) if data.files else 0
+        names = [c for c in dtypes if len(dtypes[c]) == len(state)]
+        dropped = set(dtypes) - set(names)
+        if dropped:
+            logging.warning(f"{layer}: columns missing from some partitions dropped: {sorted(dropped)}")
+        strings = [c for c in names if any(d.kind not in 'biuf' for d in dtypes[c])]
+
+        # Write into a fresh directory and swap it in so readers never see a
+        # half-built table
+        build_dir = os.path.join(layer_dir, 'table.building')
+        shutil.rmtree(build_dir, ignore_errors=True)
+        os.makedirs(os.path.join(build_dir, 'columns'))
+        os.makedirs(os.path.join(build_dir, 'index'))
+        columns_dir = os.path.join(build_dir, 'columns')
+        index_dir = os.path.join(build_dir, 'index')
+        open_memmap = np.lib.format.open_memmap
+
+        outputs, blobs, blob_sizes, key_arrays = {}, {}, {}, {}
+        for name in names:
+            if name in strings:
+                outputs[name] = open_memmap(os.path.join(columns_dir, f"{name}.offsets.npy"), mode='w+',
+                                            dtype=np.int64, shape=(rows + 1,))
+                outputs[name][0] = 0
+                blobs[name] = open(os.path.join(columns_dir, f"{name}.data"), 'wb')
+                blob_sizes[name] = 0
+                if name in KEY_COLUMNS:
+                    # Sorted as UTF-8 bytes: one byte per character for ASCII IDs
+                    key_arrays[name] = open_memmap(os.path.join(index_dir, f"{name}.unsorted.npy"), mode='w+',
+                                                   dtype=f"S{key_width.get(name, 1)}", shape=(rows,))
+            else:
+                outputs[name] = open_memmap(os.path.join(columns_dir, f"{name}.npy"), mode='w+',
+                                            dtype=np.result_type(*dtypes[name]), shape=(rows,))
+                if name in KEY_COLUMNS:
+                    key_arrays[name] = outputs[name]
+
+        try:
+            offset = 0
+            for filename in state:
+                with np.load(os.path.join(partition_dir, filename)) as data:
+                    count = 0
+                    for name in names:
+                        column = data[name]
+                        count = len(column)
+                        if name not in strings:
+                            outputs[name][offset:offset + count] = column
+                            continue
+                        encoded = [value.encode('utf-8') for value in column.astype(str).tolist()]
+                        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=count)
+                        outputs[name][offset + 1:offset + count + 1] = blob_sizes[name] + np.cumsum(lengths)
+                        blobs[name].write(b''.join(encoded))
+                        blob_sizes[name] += int(lengths.sum())
+                        if name in key_arrays:
+                            key_arrays[name][offset:offset + count] = encoded
+                    offset += count
+        finally:
+            for blob in blobs.values():
+                blob.close()
+
+        keys = []
+        for name in list(key_arrays):
+            column = key_arrays.pop(name)
+            order = np.argsort(column, kind='stable')
+            np.save(os.path.join(index_dir, f"{name}.keys.npy"), column[order])
+            np.save(os.path.join(index_dir, f"{name}.rows.npy"), order)
+            keys.append(name)
+            del column, order
+            if name in strings:
+                os.remove(os.path.join(index_dir, f"{name}.unsorted.npy"))
+        for output in outputs.values():
+            output.flush()
+        outputs.clear()
+
+        with open(os.path.join(build_dir, 'manifest.json'), 'w') as f:
+            json.dump({
+                'layer': layer,
+                'rows': rows,
+                'columns': names,
+                'strings': strings,
+                'keys': keys,
+                'partitions': state
+            }, f)
+
+        table_dir = os.path.join(layer_dir, 'table')
+        old_dir = os.path.join(layer_dir, 'table.old')
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(table_dir):
+            os.rename(table_dir, old_dir)
+        os.rename(build_dir, table_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        self._tables.pop(layer, None)
+
+        logging.info(f"Built {layer} index: {rows:,} rows, keys {keys}")
+        return rows
+
+    def layers(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            d for d in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, d, 'table', 'manifest.json'))
+        )
+
+    def _table(self, layer: str) -> Dict[str, Any]:
+        table_dir = os.path.join(self._layer_dir(layer), 'table')
+        manifest_path = os.path.join(table_dir, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            raise KeyError(f"No relationship table for {layer}")
+
+        mtime = os.path.getmtime(manifest_path)
+        table = self._tables.get(layer)
+        if table and table['mtime'] == mtime:
+            return table
+
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        # Tables built before string columns were variable-length have no
+        # 'strings' entry; their fixed-width .npy columns load as they are
+        strings = set(manifest.get('strings', []))
+        table = {
+            'mtime': mtime,
+            'manifest': manifest,
+            'columns': {
+                name: self._load_string_column(table_dir, name) if name in strings
+                else np.load(os.path.join(table_dir, 'columns', f"{name}.npy"), mmap_mode='r')
+                for name in manifest['columns']
+            },
+            'index': {
+                key: (np.load(os.path.join(table_dir, 'index', f"{key}.keys.npy"), mmap_mode='r'),
+                      np.load(os.path.join(table_dir, 'index', f"{key}.rows.npy"), mmap_mode='r'))
+                for key in manifest['keys']
+            }
+        }
+        self._tables[layer] = table
+        return table
+
+    @staticmethod
+    def _load_string_column(table_dir: str, name: str) -> StringColumn:
+        offsets = np.load(os.path.join(table_dir, 'columns', f"{name}.offsets.npy"), mmap_mode='r')
+        data_path = os.path.join(table_dir, 'columns', f"{name}.data")
+        # np.memmap cannot map an empty file (a column of empty strings)
+        data = (np.memmap(data_path, dtype=np.uint8, mode='r') if os.path.getsize(data_path)
+                else np.zeros(0, dtype=np.uint8))
+        return StringColumn(offsets, data)
+
+    def manifest(self, layer: str) -> Dict[str, Any]:
+        return self._table(layer)['manifest']
+
+    def _search(self, table: Dict[str, Any], key: str, values: Iterable):
+        if key not in table['index']:
+            raise KeyError(f"{table['manifest']['layer']} has no index on {key}")
+        sorted_keys, rows = table['index'][key]
+        values = list(values)
+        too_long = None
+        if sorted_keys.dtype.kind == 'S':
+            labels = [str(v) for v in values]
+            encoded = [label.encode('utf-8') for label in labels]
+            # A value longer than every stored key would be truncated into a false match
+            too_long = np.array([len(e) > sorted_keys.dtype.itemsize for e in encoded], dtype=bool)
+            wanted = np.array(encoded, dtype=sorted_keys.dtype)
+        elif sorted_keys.dtype.kind == 'U':
+            wanted = np.asarray([str(v) for v in values], dtype=str)
+            labels = wanted.tolist()
+        else:
+            try:
+                wanted = np.asarray(values).astype(sorted_keys.dtype)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} values must be numbers")
+            labels = wanted.tolist()
+        left = np.searchsorted(sorted_keys, wanted, side='left')
+        right = np.searchsorted(sorted_keys, wanted, side='right')
+        if too_long is not None:
+            right[too_long] = left[too_long]
+        return labels, left, right, rows
+
+    def lookup(self, layer: str, key: str, values: Iterable,
+               columns: Optional[List[str]] = None) -> Dict[Any, List[Dict[str, Any]]]:
+        """Return every row matching each value, grouped by value."""
+        table = self._table(layer)
+        columns = columns or table['manifest']['columns']
+        missing = [c for c in columns if c not in table['columns']]
+        if missing:
+            raise KeyError(f"{layer} has no columns {missing}")
+
+        wanted, left, right, rows = self._search(table, key, values)
+        counts = right - left
+        offsets = np.cumsum(counts) - counts
+        positions = np.repeat(left - offsets, counts) + np.arange(counts.sum())
+        matched = np.asarray(rows[positions])
+
+        data = {c: np.asarray(table['columns'][c][matched]).tolist() for c in columns}
+        result = {}
+        offset = 0
+        for value, count in zip(wanted, counts.tolist()):
+            result[value] = [
+                {c: data[c][i] for c in columns}
+                for i in range(offset, offset + count)
+            ]
+            offset += count
+        return result
+
+    def first_matches(self, layer: str, key: str, values: Iterable,
+                      columns: List[str]) -> Dict[str, np.ndarray]:
+        """Return the first matching row per value as arrays aligned to values.
+
+        Values without a match get None (an object array is returned for
+        those columns).
+        """
+        table = self._table(layer)
+        wanted, left, right, rows = self._search(table, key, values)
+        found = right > left
+        matched = np.asarray(rows[np.where(found, left, 0)]) if len(rows) else np.zeros(len(wanted), dtype=np.int64)
+
+        result = {}
+        for column in columns:
+            source = np.asarray(table['columns'][column][matched])
+            if found.all():
+                result[column] = source
+            else:
+                values_out = source.astype(object)
+                values_out[~found] = None
+                result[column] = values_out
+        return result
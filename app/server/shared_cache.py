@@ -0,0 +1,235 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from app.server.spatial_index import load_spatial_index
+
+# Bumped atomically by whoever publishes outputs into a data directory; every
+# server worker watches it and switches to the pack built for the new value
+GENERATION_FILE = "GENERATION"
+CACHE_DIR = ".shared_cache"
+# A pack is one file: the entries, their manifest as JSON, then an 8-byte
+# trailer holding the manifest length
+TRAILER = struct.Struct("<Q")
+
+
+@contextmanager
+def _locked(path: str):
+    with open(path, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_generation(data_dir: str) -> int:
+    try:
+        with open(os.path.join(data_dir, GENERATION_FILE), 'r') as f:
+            return json.load(f)['generation']
+    except (OSError, ValueError, KeyError):
+        return 0
+
+
+def bump_generation(data_dir: str, layers: Iterable[str] = ()) -> int:
+    """Mark new outputs as published. Call after they are fully written."""
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, GENERATION_FILE)
+    with _locked(f"{path}.lock"):
+        generation = read_generation(data_dir) + 1
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'generation': generation, 'layers': sorted(layers), 'time': time.time()}, f)
+        os.replace(tmp_path, path)
+    return generation
+
+
+def list_layer_files(data_dir: str) -> Dict[str, List[str]]:
+    """TopoJSON files per layer directory, as served by /api/layers."""
+    layers = {}
+    if os.path.isdir(data_dir):
+        for layer_name in sorted(os.listdir(data_dir)):
+            layer_dir = os.path.join(data_dir, layer_name)
+            if layer_name.startswith('.') or not os.path.isdir(layer_dir):
+                continue
+            files = sorted(f for f in os.listdir(layer_dir) if f.endswith('.topojson'))
+            if files:
+                layers[layer_name] = files
+    return layers
+
+
+def _json_bytes(value) -> bytes:
+    # Same encoding as FastAPI's JSONResponse
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def build_pack(data_dir: str, path: str, hot_layers: Iterable[str] = (), max_bytes: int = 0) -> int:
+    """Write the layer listing, every spatial index and as many layer files
+    as fit in max_bytes (hot layers first, then smallest files) to one pack."""
+    layers = list_layer_files(data_dir)
+    entries = [('layers', _json_bytes({"layers": layers}))]
+    for layer in layers:
+        index = load_spatial_index(os.path.join(data_dir, layer))
+        if index is not None:
+            entries.append((f"index/{layer}", _json_bytes(index)))
+
+    hot = set(hot_layers or [])
+    candidates = [(layer not in hot, os.path.getsize(os.path.join(data_dir, layer, name)), layer, name)
+                  for layer, files in layers.items() for name in files]
+    budget = max_bytes
+    files = []
+    for _, size, layer, name in sorted(candidates):
+        if size <= budget:
+            budget -= size
+            files.append((layer, name))
+
+    manifest = {}
+    offset = 0
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as out:
+        for key, data in entries:
+            out.write(data)
+            manifest[key] = [offset, len(data)]
+            offset += len(data)
+        for layer, name in files:
+            # Offsets come from what was read, so a file replaced meanwhile
+            # cannot shift the entries after it
+            with open(os.path.join(data_dir, layer, name), 'rb') as f:
+                data = f.read()
+            out.write(data)
+            manifest[f"file/{layer}/{name}"] = [offset, len(data)]
+            offset += len(data)
+        header = _json_bytes(manifest)
+        out.write(header)
+        out.write(TRAILER.pack(len(header)))
+    os.replace(tmp_path, path)
+    return offset
+
+
+class SharedCache:
+    """Read-only view of the current pack, mapped by every worker.
+
+    Pages of the mapping live in the OS page cache, so N workers hold one
+    copy rather than N. A worker checks the generation at most every
+    `check_interval` seconds, so it may answer from the old pack for that
+    long after a bump. On a change it stops serving from the old pack
+    (callers fall back to disk). Once the generation has been unchanged for
+    `build_delay` seconds, one process, under a file lock, builds the new
+    pack in the background for everyone to map.
+    """
+
+    def __init__(self, data_dir: str, hot_layers: Iterable[str] = (), max_bytes: int = 256 * 1024 * 1024,
+                 check_interval: float = 0.5, build_delay: float = 2.0):
+        self.data_dir = data_dir
+        self.cache_dir = os.path.join(data_dir, CACHE_DIR)
+        self.hot_layers = list(hot_layers or [])
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self.build_delay = build_delay
+        self._generation = None
+        self._checked = 0.0
+        self._changed_at = 0.0
+        # (mapping, manifest) replaced as one so threadpool routes never mix packs
+        self._pack: Optional[tuple] = None
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def _pack_path(self, generation: int) -> str:
+        return os.path.join(self.cache_dir, f"pack-{generation}.bin")
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        self._checked = now
+
+        generation = read_generation(self.data_dir)
+        if generation != self._generation:
+            self._pack = None
+            self._generation = generation
+            self._changed_at = now
+        if self._pack is not None:
+            return
+
+        path = self._pack_path(generation)
+        if os.path.exists(path):
+            self._map(path)
+        elif now - self._changed_at >= self.build_delay:
+            # Publishers may bump several times in a row; build once they stop
+            self._start_build(generation)
+
+    def _map(self, path: str):
+        try:
+            with open(path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not map {path}: {str(e)}")
+            return
+        view = memoryview(mapped)
+        (length,) = TRAILER.unpack_from(view, len(view) - TRAILER.size)
+        manifest_start = len(view) - TRAILER.size - length
+        manifest = json.loads(bytes(view[manifest_start:manifest_start + length]))
+        # The old mapping is released once no response still references it
+        self._pack = (view, manifest)
+
+    def _start_build(self, generation: int):
+        with self._lock:
+            if generation in self._building:
+                return
+            self._building.add(generation)
+        threading.Thread(target=self._build, args=(generation,), daemon=True).start()
+
+    def _build(self, generation: int):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            path = self._pack_path(generation)
+            with _locked(os.path.join(self.cache_dir, "build.lock")):
+                if os.path.exists(path) or read_generation(self.data_dir) != generation:
+                    return
+                started = time.time()
+                size = build_pack(self.data_dir, path, self.hot_layers, self.max_bytes)
+                logging.info(f"Built shared cache generation {generation} "
+                             f"({size / (1024 * 1024):.1f}MB) in {time.time() - started:.2f}s")
+                for name in os.listdir(self.cache_dir):
+                    # Workers still mapping an unlinked pack keep their pages
+                    if name.startswith("pack-") and name != os.path.basename(path):
+                        os.remove(os.path.join(self.cache_dir, name))
+        except Exception as e:
+            logging.error(f"Error building shared cache generation {generation}: {str(e)}")
+        finally:
+            with self._lock:
+                self._building.discard(generation)
+            # Map on the next request rather than waiting out the interval
+            self._checked = 0.0
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """Bytes for `key` straight from the mapping, or None to read from disk."""
+        self._refresh()
+        pack = self._pack
+        if pack is None:
+            return None
+        view, manifest = pack
+        entry = manifest.get(key)
+        if entry is None:
+            return None
+        start, length = entry
+        return view[start:start + length]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Tell running servers that outputs changed, e.g. after copying files in by hand")
+    parser.add_argument('data_dir', nargs='?', default="app/server/data")
+    parser.add_argument('--layers', nargs='*', default=[])
+    args = parser.parse_args()
+    print(f"{args.data_dir} is now at generation {bump_generation(args.data_dir, args.layers)}")
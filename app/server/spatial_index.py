@@ -0,0 +1,67 @@
+import json
+import logging
+import os
+from typing import List, Optional
+
+# Per-layer index of output files and their bounds, read by the client to
+# fetch only the files intersecting the current view
+SPATIAL_INDEX_FILE = "spatial_index.json"
+
+
+def _entry(filename: str, bbox: List[float], size: int) -> dict:
+    return {
+        "filename": filename,
+        "bounds": {
+            "west": bbox[0],
+            "south": bbox[1],
+            "east": bbox[2],
+            "north": bbox[3]
+        },
+        "size": size
+    }
+
+
+def _write_index(layer_dir: str, index: dict) -> str:
+    index_path = os.path.join(layer_dir, SPATIAL_INDEX_FILE)
+    tmp_path = f"{index_path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+    return index_path
+
+
+def load_spatial_index(layer_dir: str) -> Optional[dict]:
+    index_path = os.path.join(layer_dir, SPATIAL_INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, 'r') as f:
+        return json.load(f)
+
+
+def update_spatial_index(layer_dir: str, filename: str, bbox: List[float]) -> str:
+    """Add or replace one file's entry after it has been written."""
+    index = load_spatial_index(layer_dir) or {"files": []}
+    size = os.path.getsize(os.path.join(layer_dir, filename))
+    index["files"] = [f for f in index["files"] if f["filename"] != filename]
+    index["files"].append(_entry(filename, [float(b) for b in bbox], size))
+    index["files"].sort(key=lambda f: f["filename"])
+    return _write_index(layer_dir, index)
+
+
+def build_spatial_index(layer_dir: str) -> str:
+    """Rebuild a layer's index from the bbox of every TopoJSON file in it."""
+    index = {"files": []}
+    for filename in sorted(os.listdir(layer_dir)):
+        if not filename.endswith('.topojson'):
+            continue
+        path = os.path.join(layer_dir, filename)
+        try:
+            with open(path, 'r') as f:
+                bbox = json.load(f).get('bbox')
+            if bbox:
+                index["files"].append(_entry(filename, bbox, os.path.getsize(path)))
+            else:
+                logging.warning(f"No bbox found in {filename}")
+        except Exception as e:
+            logging.error(f"Error indexing {filename}: {str(e)}")
+    return _write_index(layer_dir, index)
@@ -1,3 +1,4 @@
+import argparse
 import asyncio
 import csv
 import io
@@ -5,26 +6,52 @@ import json
 import logging
 import os
 import shutil
+import sys
 import time
 import zipfile
 from datetime import datetime
 from ftplib import FTP
-from typing import Dict, Any, Optional
-
-import aiohttp
-import geopandas as gpd
-import pygeohash as gh
-import topojson
+from typing import Callable, Collection, Dict, Any, List, Optional
 
 from app.server.config.tiger_config import TigerConfig
 from app.server.config.layer_config import LayerConfig
+from app.server.attribute_encoding import read_columns, apply_dtypes, dictionary_encode
+from app.server.attribute_sidecar import sidecar_filename, write_sidecar
+from app.server.spatial_index import update_spatial_index
+from app.server.relationship_store import RelationshipStore, RELATIONSHIPS_DIR
+from app.server.topology_merge import merge_layer, merge_source_path
+from app.server.arc_simplify import simplify_topology
+from app.server.catalog import CatalogError, RemoteCatalog, build_plan, load_processed_log, log_timestamp, print_plan
+from app.server.processor_status import print_status, verify_outputs
+from app.server.shared_cache import bump_generation
+
+def print_progress(event: Dict[str, Any]):
+    """Default progress hook: a live download line on stdout."""
+    if event['stage'] != 'download':
+        return
+    total_mb = event['total'] / (1024 * 1024)
+    downloaded_mb = event['downloaded'] / (1024 * 1024)
+    print(f"\rProgress: {event['percent']:.1f}% ({downloaded_mb:.1f}MB of {total_mb:.1f}MB) "
+          f"[{event['speed'] / (1024 * 1024):.1f}MB/s]", end="")
+    if event['downloaded'] >= event['total']:
+        print()
+
 
 class TigerProcessor:
-    def __init__(self, config_path: Optional[str] = None):
+    def __init__(self, config_path: Optional[str] = None, output_dir: Optional[str] = None,
+                 progress: Optional[Callable[[Dict[str, Any]], None]] = None):
         self.config = TigerConfig(config_path)
+        if output_dir:
+            self.config.processing.output_dir = output_dir
+        # Called with a dict per progress event: 'download' while fetching,
+        # 'file' and 'layer' as work starts and finishes
+        self.progress = progress or print_progress
         self._setup_environment()
         self.processed_files = self._load_processed_files()
-        self.connect_ftp()
+        self.relationships = RelationshipStore(
+            os.path.join(self.config.processing.output_dir, RELATIONSHIPS_DIR))
+        # Opened on the first download, so runs with nothing to fetch never connect
+        self.ftp: Optional[FTP] = None
 
     def _setup_environment(self):
         output_dir = self.config.processing.output_dir
@@ -71,7 +98,7 @@ class TigerProcessor:
             writer = csv.writer(f)
             writer.writerow([
                 directory, filename, status,
-                time.strftime('%Y-%m-%d %H:%M:%S'), protocol
+                log_timestamp(), protocol
             ])
         logging.info(f"{directory}/{filename}: {status} via {protocol}")
 
@@ -85,30 +112,19 @@ class TigerProcessor:
             print("Connected to FTP server")
             self.ftp.login()
             print("Logged in successfully")
-            
-            path_parts = self.config.servers.base_path.strip('/').split('/')
-            current_path = ''
-            for part in path_parts:
-                next_path = f"{current_path}/{part}" if current_path else f"/{part}"
-                print(f"\nTrying to access: {next_path}")
-                if current_path:
-                    print(f"\nCurrent directory ({current_path}) contents:")
-                    try:
-                        dir_files = self.ftp.nlst()
-                        print("\n".join(sorted(dir_files)))
-                    except Exception as e:
-                        print(f"Error listing directory: {str(e)}")
-                try:
-                    self.ftp.cwd(next_path)
-                    current_path = next_path
-                except Exception as e:
-                    print(f"Error accessing {next_path}: {str(e)}")
-                    raise
+            self.ftp.cwd(self.config.servers.base_path)
         except Exception as e:
             logging.error(f"FTP connection error: {str(e)}")
             raise
 
+    def _ftp_connection(self) -> FTP:
+        if self.ftp is None:
+            self.connect_ftp()
+        return self.ftp
+
     async def download_https(self, directory: str, filename: str) -> io.BytesIO:
+        import aiohttp
+
         https_url = f"https://{self.config.servers.https_host}{self.config.servers.base_path}/{directory}/{filename}"
         try:
             async with aiohttp.ClientSession() as session:
@@ -127,8 +143,9 @@ class TigerProcessor:
         while retries < max_retries:
             try:
                 response = io.BytesIO()
-                self.ftp.cwd(f'{self.config.servers.base_path}/{directory}')
-                size = self.ftp.size(filename)
+                ftp = self._ftp_connection()
+                ftp.cwd(f'{self.config.servers.base_path}/{directory}')
+                size = ftp.size(filename)
                 size_mb = size / (1024 * 1024)
                 print(f"\nDownloading {filename} (Total size: {size_mb:.1f}MB)")
                 
@@ -139,21 +156,27 @@ class TigerProcessor:
                 def callback(data):
                     nonlocal downloaded, last_time, last_size
                     downloaded += len(data)
+                    response.write(data)
                     current_time = time.time()
-                    if current_time - last_time > 1:
-                        speed = (downloaded - last_size) / (current_time - last_time) / (1024 * 1024)
-                        percent = (downloaded / size) * 100
-                        downloaded_mb = downloaded / (1024 * 1024)
-                        print(f"\rProgress: {percent:.1f}% ({downloaded_mb:.1f}MB of {size_mb:.1f}MB) [{speed:.1f}MB/s]", end="")
+                    if current_time - last_time > 1 or downloaded >= size:
+                        self.progress({
+                            'stage': 'download',
+                            'layer': directory,
+                            'file': filename,
+                            'downloaded': downloaded,
+                            'total': size,
+                            'percent': downloaded / size * 100 if size else 100.0,
+                            'speed': (downloaded - last_size) / max(current_time - last_time, 1e-6)
+                        })
                         last_time = current_time
                         last_size = downloaded
-                    response.write(data)
 
-                self.ftp.retrbinary(f'RETR {filename}', callback)
-                print()
+                ftp.retrbinary(f'RETR {filename}', callback)
                 response.seek(0)
                 return response
             except Exception as e:
+                # Drop the connection in case it went stale; the next attempt reconnects
+                self.close()
                 retries += 1
                 if retries == max_retries:
                     print(f"\nFTP download failed, trying HTTPS...")
@@ -167,7 +190,7 @@ class TigerProcessor:
                     print(f"\nDownload attempt {retries} failed, waiting {wait_time} seconds...")
                     await asyncio.sleep(wait_time)
 
-    async def process_layer(self, directory: str, filename: str) -> Dict[str, Any]:
+    async def process_layer(self, directory: str, filename: str, force: bool = False) -> Dict[str, Any]:
         if not self.config.is_layer_enabled(directory):
             print(f"Layer {directory} is disabled, skipping {filename}")
             return {
@@ -177,10 +200,11 @@ class TigerProcessor:
                 'message': f"Layer {directory} is disabled"
             }
 
-        if (directory, filename) in self.processed_files:
+        if (directory, filename) in self.processed_files and not force:
             print(f"Already processed {filename}, skipping")
             return {'success': True, 'file': filename, 'status': 'skipped'}
 
+        self.progress({'stage': 'file', 'layer': directory, 'file': filename, 'status': 'started'})
         try:
             layer_config = self.config.get_layer_config(directory)
             if not layer_config:
@@ -191,15 +215,12 @@ class TigerProcessor:
                 }
 
             if layer_config.layer_type == "RELATIONSHIP":
-                return {
-                    'success': True,
-                    'file': filename,
-                    'status': 'skipped_relationship'
-                }
-
-            output_path = await self._process_spatial_file(layer_config, directory, filename)
+                output_path = await self._process_relationship_file(layer_config, directory, filename)
+            else:
+                output_path = await self._process_spatial_file(layer_config, directory, filename)
             self._log_processed_file(directory, filename, 'success')
             self.processed_files.add((directory, filename))
+            self.progress({'stage': 'file', 'layer': directory, 'file': filename, 'status': 'success'})
 
             return {
                 'success': True,
@@ -212,9 +233,53 @@ class TigerProcessor:
             error_msg = f"Error processing {filename}: {str(e)}"
             logging.error(error_msg)
             self._log_processed_file(directory, filename, f'error: {str(e)}')
+            self.progress({'stage': 'file', 'layer': directory, 'file': filename, 'status': 'error', 'error': str(e)})
             return {'success': False, 'file': filename, 'error': str(e)}
 
+    async def _process_relationship_file(self, layer_config: LayerConfig, directory: str, filename: str) -> str:
+        temp_dir = os.path.join(self.relationships.root, directory, "temp_dbf")
+        os.makedirs(temp_dir, exist_ok=True)
+
+        try:
+            print(f"\nProcessing {filename}:")
+            response = await self._download_file(directory, filename)
+            print("Extracting table...")
+            with zipfile.ZipFile(response) as zip_ref:
+                zip_ref.extractall(temp_dir)
+
+            base_name = filename.replace('.zip', '')
+            dbf_file = os.path.join(temp_dir, f"{base_name}.dbf")
+
+            print("Ingesting table...")
+            rows = self.relationships.ingest(directory, base_name, dbf_file)
+            print(f"Completed {filename} ({rows:,} rows)")
+            return os.path.join(self.relationships.root, directory)
+        finally:
+            if os.path.exists(temp_dir):
+                shutil.rmtree(temp_dir)
+
+    def _apply_joins(self, layer_config: LayerConfig, gdf):
+        for join in layer_config.joins or []:
+            table, key, columns = join['table'], join['key'], join['columns']
+            if key not in gdf.columns:
+                logging.warning(f"{layer_config.name}: cannot join {table}, no {key} column")
+                continue
+            try:
+                matches = self.relationships.first_matches(table, key, gdf[key].to_numpy(), columns)
+            except (KeyError, ValueError) as e:
+                logging.warning(f"{layer_config.name}: cannot join {table}: {str(e)}")
+                continue
+            for column, values in matches.items():
+                target = column if column not in gdf.columns else f"{table}_{column}"
+                gdf[target] = values
+            print(f"Joined {columns} from {table} on {key}")
+        return gdf
+
     async def _process_spatial_file(self, layer_config: LayerConfig, directory: str, filename: str) -> str:
+        import geopandas as gpd
+        import pygeohash as gh
+        import topojson
+
         dir_path = os.path.join(self.config.processing.output_dir, directory)
         os.makedirs(dir_path, exist_ok=True)
         temp_dir = os.path.join(dir_path, "temp_shp")
@@ -231,8 +296,17 @@ class TigerProcessor:
             shp_file = os.path.join(temp_dir, f"{base_name}.shp")
             
             print("Reading shapefile...")
-            gdf = gpd.read_file(shp_file)
+            join_keys = [j['key'] for j in layer_config.joins or []]
+            columns = read_columns(shp_file, layer_config.columns, layer_config.drop_columns, required=join_keys)
+            gdf = gpd.read_file(shp_file, columns=columns)
+            gdf = apply_dtypes(gdf, layer_config.dtypes)
             print(f"Loaded {len(gdf):,} features")
+            gdf = self._apply_joins(layer_config, gdf)
+            unwanted = [k for k in join_keys if k in gdf.columns and (
+                k in (layer_config.drop_columns or []) or
+                (layer_config.columns and k not in layer_config.columns))]
+            if unwanted:
+                gdf = gdf.drop(columns=unwanted)
             
             bounds = gdf.total_bounds
             center_lat = (bounds[1] + bounds[3]) / 2
@@ -240,20 +314,69 @@ class TigerProcessor:
             geohash = gh.encode(center_lat, center_lon, precision=5)
             
             tolerance = layer_config.tolerance or self.config.processing.base_tolerance
-            print(f"Processing geometry...")
-            gdf['geometry'] = gdf['geometry'].simplify(
-                tolerance=tolerance,
-                preserve_topology=True
-            )
+            # Merging reads an unsimplified copy, so shared borders are simplified once
+            keep_source = self.config.processing.merge_outputs
+            source_geometry = gdf['geometry'].to_numpy() if keep_source else None
+            if layer_config.simplify_mode != "arc":
+                print(f"Processing geometry...")
+                gdf['geometry'] = gdf['geometry'].simplify(
+                    tolerance=tolerance,
+                    preserve_topology=True
+                )
             
-            print("Converting to TopoJSON...")
-            topo = topojson.Topology(gdf, prequantize=False)
             output_filename = f"{base_name}.{geohash}.topojson"
             output_path = os.path.join(dir_path, output_filename)
-            
+
+            sidecar = None
+            dictionaries = {}
+            if layer_config.attribute_mode == "sidecar":
+                # Feature ids are row positions in the sidecar
+                gdf = gdf.reset_index(drop=True)
+                sidecar = gdf.drop(columns='geometry')
+                gdf = gdf[['geometry']]
+            else:
+                gdf, dictionaries = dictionary_encode(gdf, self.config.processing.dictionary_max_unique)
+                if dictionaries:
+                    print(f"Dictionary encoded {', '.join(dictionaries)}")
+
+            print("Converting to TopoJSON...")
+            topo = topojson.Topology(gdf, prequantize=False)
+            topo_dict = topo.to_dict()
+            sidecar_name = None
+            if sidecar is not None:
+                sidecar_name = sidecar_filename(output_filename)
+                print(f"Saving {sidecar_name}")
+                write_sidecar(sidecar, os.path.join(dir_path, sidecar_name),
+                              self.config.processing.dictionary_max_unique)
+
+            def finish(topo_dict: dict) -> dict:
+                if dictionaries:
+                    topo_dict['dictionaries'] = dictionaries
+                if sidecar_name:
+                    for geometry in topo_dict['objects']['data']['geometries']:
+                        geometry.pop('properties', None)
+                    topo_dict['sidecar'] = {'layer': directory, 'file': sidecar_name}
+                return topo_dict
+
+            if keep_source:
+                if layer_config.simplify_mode == "arc":
+                    source = topo_dict
+                else:
+                    source_gdf = gdf.copy()
+                    source_gdf['geometry'] = source_geometry
+                    source = topojson.Topology(source_gdf, prequantize=False).to_dict()
+                source_path = merge_source_path(dir_path, output_filename)
+                os.makedirs(os.path.dirname(source_path), exist_ok=True)
+                self._write_json(finish(source), source_path)
+
+            if layer_config.simplify_mode == "arc":
+                print(f"Simplifying {len(topo_dict['arcs']):,} arcs ({layer_config.simplify_algorithm})...")
+                simplify_topology(topo_dict, tolerance, layer_config.simplify_algorithm,
+                                  workers=self.config.processing.simplify_workers)
+
             print(f"Saving {output_filename}")
-            with open(output_path, 'w') as f:
-                json.dump(topo.to_dict(), f)
+            self._write_json(finish(topo_dict), output_path)
+            update_spatial_index(dir_path, output_filename, bounds)
             
             print(f"Completed {filename}")
             return output_path
@@ -261,38 +384,134 @@ class TigerProcessor:
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
 
-    async def process_all(self):
+    def _write_json(self, value: dict, path: str):
+        # Replace atomically so the server never maps a half-written file
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    async def process_files(self, directory: str, filenames: List[str],
+                            force: Collection[str] = ()) -> Dict[str, Any]:
+        """Process the given files of one layer, then index or merge it.
+        Files in `force` are reprocessed even if already logged as done."""
+        self.progress({'stage': 'layer', 'layer': directory, 'status': 'started', 'files': len(filenames)})
+        results = []
+        for file_idx, filename in enumerate(filenames, 1):
+            print(f"\nFile {file_idx} of {len(filenames)}")
+            results.append(await self.process_layer(directory, filename, force=filename in force))
+        print(f"\nCompleted layer: {directory}")
+        summary = {
+            'layer': directory,
+            'processed': sum(1 for r in results if r['success'] and 'status' not in r),
+            'skipped': sum(1 for r in results if r.get('status', '').startswith('skipped')),
+            'failed': [r['file'] for r in results if not r['success']]
+        }
+
+        if self.config.get_layer_config(directory).layer_type == "RELATIONSHIP":
+            try:
+                self.relationships.build_index(directory)
+            except Exception as e:
+                logging.error(f"Error indexing relationship layer {directory}: {str(e)}")
+                print(f"Error indexing relationship layer {directory}: {str(e)}")
+        elif self.config.processing.merge_outputs and summary['processed']:
+            # Re-merging is as costly as the first merge, so only after new outputs
+            self.merge_layer(directory)
+        if summary['processed']:
+            # Once per layer, after its merged output or relationship index
+            bump_generation(self.config.processing.output_dir, [directory])
+
+        self.progress(dict(summary, stage='layer', status='completed'))
+        return summary
+
+    async def process_all(self, refresh_catalog: bool = False,
+                          layers: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        summaries = {}
         try:
             print("\nScanning available layers...")
-            directories = [d for d in self.ftp.nlst() if '.' not in d]
-            enabled_dirs = [d for d in directories if self.config.is_layer_enabled(d)]
+            catalog = RemoteCatalog(self.config).load(refresh=refresh_catalog, layers=layers)
+            plan = build_plan(catalog, load_processed_log(self.log_file), self.config)
+            enabled_dirs = [d for d in plan if layers is None or d in layers]
+            # Relationship tables first so spatial layers can join against them
+            enabled_dirs.sort(key=lambda d: self.config.get_layer_config(d).layer_type != "RELATIONSHIP")
             print(f"\nFound {len(enabled_dirs)} enabled layers to process")
 
             for layer_idx, dir in enumerate(enabled_dirs, 1):
+                pending = plan[dir]['pending']
                 print(f"\nLayer {layer_idx} of {len(enabled_dirs)}: {dir}")
-                self.ftp.cwd(f'{self.config.servers.base_path}/{dir}')
-                files = [f for f in self.ftp.nlst() if f.endswith('.zip')]
-                print(f"Found {len(files)} files to process in {dir}")
-                
-                for file_idx, file in enumerate(files, 1):
-                    print(f"\nFile {file_idx} of {len(files)}")
-                    await self.process_layer(dir, file)
-                print(f"\nCompleted layer: {dir}")
-            
+                if not pending:
+                    print(f"{dir} is up to date ({plan[dir]['total_files']} files)")
+                    continue
+                print(f"Found {len(pending)} of {plan[dir]['total_files']} files to process in {dir} "
+                      f"({plan[dir]['pending_bytes'] / (1024 * 1024):.1f}MB)")
+                summaries[dir] = await self.process_files(
+                    dir, [f['name'] for f in pending],
+                    force={f['name'] for f in pending if f['reason'] == 'modified'})
+
             print("\nAll layers processed successfully!")
+            return summaries
         except Exception as e:
             print(f"\nError during processing: {str(e)}")
             raise
         finally:
             self.close()
 
+    def merge_layer(self, directory: str) -> list:
+        layer_config = self.config.get_layer_config(directory)
+        try:
+            return merge_layer(
+                self.config.processing.output_dir,
+                directory,
+                precision=self.config.processing.merge_precision,
+                region_precision=self.config.processing.merge_region_precision,
+                workers=self.config.processing.merge_workers,
+                dictionary_max_unique=self.config.processing.dictionary_max_unique,
+                attribute_mode=layer_config.attribute_mode,
+                tolerance=layer_config.tolerance or self.config.processing.base_tolerance,
+                simplify_algorithm=layer_config.simplify_algorithm
+            )
+        except Exception as e:
+            logging.error(f"Error merging layer {directory}: {str(e)}")
+            print(f"Error merging layer {directory}: {str(e)}")
+            return []
+
     def close(self):
+        if self.ftp is None:
+            return
         try:
             self.ftp.quit()
         except:
             pass
+        self.ftp = None
 
 if __name__ == "__main__":
-    config_path = os.path.join(os.path.dirname(__file__), 'tiger_config.yaml') 
-    processor = TigerProcessor(config_path)
-    asyncio.run(processor.process_all())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Download and convert TIGER/Line layers")
+    commands = parser.add_subparsers(dest='command')
+    run_parser = commands.add_parser('run', help="process pending files (the default)")
+    plan_parser = commands.add_parser('plan', help="list pending files and bytes per layer without downloading")
+    for command in (run_parser, plan_parser):
+        command.add_argument('--refresh-catalog', action='store_true',
+                             help="re-list the server even if the cached catalog is fresh")
+    commands.add_parser('status', help="summarize processed files and outputs from local state only")
+    verify_parser = commands.add_parser('verify', help="check outputs against spatial indexes")
+    verify_parser.add_argument('--quick', action='store_true',
+                               help="check presence and index membership without parsing files")
+    args = parser.parse_args()
+
+    config_path = os.path.join(os.path.dirname(__file__), 'tiger_config.yaml')
+    try:
+        if args.command == 'plan':
+            config = TigerConfig(config_path)
+            catalog = RemoteCatalog(config).load(refresh=args.refresh_catalog)
+            log_file = os.path.join(config.processing.output_dir, "processed_files.csv")
+            print_plan(build_plan(catalog, load_processed_log(log_file), config))
+        elif args.command == 'status':
+            print_status(TigerConfig(config_path))
+        elif args.command == 'verify':
+            sys.exit(1 if verify_outputs(TigerConfig(config_path), quick=args.quick) else 0)
+        else:
+            processor = TigerProcessor(config_path)
+            asyncio.run(processor.process_all(refresh_catalog=getattr(args, 'refresh_catalog', False)))
+    except CatalogError as e:
+        print(f"\n{str(e)}")
+        sys.exit(1)
@@ -0,0 +1,378 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.server.attribute_encoding import decode_properties, dictionary_encode_properties
+from app.server.attribute_sidecar import read_sidecar_properties, sidecar_filename, write_sidecar
+from app.server.spatial_index import build_spatial_index
+
+# Each merged layer is written to its own directory next to the per-file
+# layer, so it is listed, browsed and queried as a layer of its own and
+# served as /MERGED_{LAYER}/{LAYER}.{region}.topojson
+MERGED_PREFIX = "MERGED_"
+# Unsimplified copies of the per-file outputs, kept in the layer directory
+# when merging is on. Merging these and simplifying the merged arcs once
+# keeps a border shared by two files identical, so it is stored once.
+MERGE_SOURCE_DIR = ".merge_source"
+
+
+def merged_layer_name(layer_name: str) -> str:
+    return f"{MERGED_PREFIX}{layer_name}"
+
+
+def merge_source_path(layer_dir: str, output_filename: str) -> str:
+    return os.path.join(layer_dir, MERGE_SOURCE_DIR, output_filename)
+
+
+def decode_arcs(topo: dict) -> List[List[Tuple[float, float]]]:
+    transform = topo.get('transform')
+    arcs = []
+    for arc in topo.get('arcs', []):
+        if transform:
+            sx, sy = transform['scale']
+            tx, ty = transform['translate']
+            x = y = 0
+            points = []
+            for dx, dy in arc:
+                x += dx
+                y += dy
+                points.append((x * sx + tx, y * sy + ty))
+            arcs.append(points)
+        else:
+            arcs.append([(p[0], p[1]) for p in arc])
+    return arcs
+
+
+def _quantize_point(point, precision: float) -> Tuple[int, int]:
+    return (round(point[0] / precision), round(point[1] / precision))
+
+
+def _quantize_geometry(geometry: dict, topo: dict, precision: float) -> dict:
+    geometry = dict(geometry)
+    transform = topo.get('transform')
+    # Dictionaries are per file, so codes are expanded before merging
+    if 'properties' in geometry:
+        geometry['properties'] = decode_properties(geometry['properties'], topo.get('dictionaries'))
+
+    def absolute(point):
+        if transform:
+            return (point[0] * transform['scale'][0] + transform['translate'][0],
+                    point[1] * transform['scale'][1] + transform['translate'][1])
+        return point
+
+    if geometry.get('type') == 'Point':
+        geometry['coordinates'] = list(_quantize_point(absolute(geometry['coordinates']), precision))
+    elif geometry.get('type') == 'MultiPoint':
+        geometry['coordinates'] = [list(_quantize_point(absolute(p), precision))
+                                   for p in geometry['coordinates']]
+    elif geometry.get('type') == 'GeometryCollection':
+        geometry['geometries'] = [_quantize_geometry(g, topo, precision)
+                                  for g in geometry['geometries']]
+    return geometry
+
+
+def _quantize_arc(arc, precision: float) -> List[Tuple[int, int]]:
+    points = []
+    for point in arc:
+        q = _quantize_point(point, precision)
+        if not points or points[-1] != q:
+            points.append(q)
+    if len(points) == 1:
+        points.append(points[0])
+    return points
+
+
+def load_quantized(path: str, precision: float) -> dict:
+    """Read a per-file TopoJSON output and snap it onto the shared integer grid."""
+    with open(path, 'r') as f:
+        topo = json.load(f)
+
+    arcs = [_quantize_arc(arc, precision) for arc in decode_arcs(topo)]
+
+    # Sidecar outputs keep properties out of the geometry file; pull them
+    # back in by feature id so they travel with their geometry
+    sidecar_properties = None
+    if topo.get('sidecar'):
+        sidecar_dir = os.path.dirname(path)
+        if os.path.basename(sidecar_dir) == MERGE_SOURCE_DIR:
+            # Source copies share the published output's sidecar
+            sidecar_dir = os.path.dirname(sidecar_dir)
+        sidecar_properties = read_sidecar_properties(os.path.join(sidecar_dir, topo['sidecar']['file']))
+
+    geometries = []
+    for obj in topo.get('objects', {}).values():
+        members = obj['geometries'] if obj.get('type') == 'GeometryCollection' else [obj]
+        for member in members:
+            geometry = _quantize_geometry(member, topo, precision)
+            if sidecar_properties is not None and geometry.get('id') is not None:
+                geometry['properties'] = sidecar_properties[geometry['id']]
+            geometries.append(geometry)
+
+    return {'arcs': arcs, 'geometries': geometries, 'input_arcs': len(arcs)}
+
+
+def _find_junctions(arcs: List[List[Tuple[int, int]]]) -> set:
+    # A vertex is a junction when it ends an arc or when the arcs running
+    # through it disagree about its neighbours, i.e. where a shared border
+    # starts or stops being shared.
+    neighbours = {}
+    junctions = set()
+    for arc in arcs:
+        junctions.add(arc[0])
+        junctions.add(arc[-1])
+        for i in range(1, len(arc) - 1):
+            pair = frozenset((arc[i - 1], arc[i + 1]))
+            seen = neighbours.setdefault(arc[i], pair)
+            if seen != pair:
+                junctions.add(arc[i])
+    return junctions
+
+
+def _split_arc(arc: List[Tuple[int, int]], junctions: set) -> List[List[Tuple[int, int]]]:
+    pieces = []
+    start = 0
+    for i in range(1, len(arc) - 1):
+        if arc[i] in junctions:
+            pieces.append(arc[start:i + 1])
+            start = i
+    pieces.append(arc[start:])
+    return pieces
+
+
+def _remap_arc_refs(refs, mapping: List[List[int]]):
+    if refs and isinstance(refs[0], list):
+        return [_remap_arc_refs(r, mapping) for r in refs]
+    remapped = []
+    for ref in refs:
+        if ref >= 0:
+            remapped.extend(mapping[ref])
+        else:
+            remapped.extend(~r for r in reversed(mapping[~ref]))
+    return remapped
+
+
+def _remap_geometry(geometry: dict, mapping: List[List[int]]) -> dict:
+    if 'arcs' in geometry:
+        geometry = dict(geometry)
+        geometry['arcs'] = _remap_arc_refs(geometry['arcs'], mapping)
+    elif geometry.get('type') == 'GeometryCollection':
+        geometry = dict(geometry)
+        geometry['geometries'] = [_remap_geometry(g, mapping) for g in geometry['geometries']]
+    return geometry
+
+
+def merge_pair(left: dict, right: dict) -> dict:
+    """Merge two quantized topologies, cutting arcs at the new junctions and
+    storing every shared arc once."""
+    junctions = _find_junctions(left['arcs'] + right['arcs'])
+
+    arcs = []
+    index = {}
+    geometries = []
+    for part in (left, right):
+        mapping = []
+        for arc in part['arcs']:
+            refs = []
+            for piece in _split_arc(arc, junctions):
+                key = tuple(piece)
+                if key in index:
+                    refs.append(index[key])
+                    continue
+                reverse_key = key[::-1]
+                if reverse_key in index:
+                    refs.append(~index[reverse_key])
+                    continue
+                index[key] = len(arcs)
+                refs.append(len(arcs))
+                arcs.append(piece)
+            mapping.append(refs)
+        geometries.extend(_remap_geometry(g, mapping) for g in part['geometries'])
+
+    return {
+        'arcs': arcs,
+        'geometries': geometries,
+        'input_arcs': left['input_arcs'] + right['input_arcs']
+    }
+
+
+def _merge_pair_args(args):
+    return merge_pair(*args)
+
+
+def _load_quantized_args(args):
+    return load_quantized(*args)
+
+
+def to_topojson(merged: dict, precision: float, dictionary_max_unique: int = 0) -> dict:
+    """Delta-encode a merged topology with a transform for the shared grid."""
+    points = [p for arc in merged['arcs'] for p in arc]
+    for geometry in merged['geometries']:
+        if geometry.get('type') == 'Point':
+            points.append(tuple(geometry['coordinates']))
+        elif geometry.get('type') == 'MultiPoint':
+            points.extend(tuple(p) for p in geometry['coordinates'])
+    if not points:
+        points = [(0, 0)]
+
+    min_x = min(p[0] for p in points)
+    min_y = min(p[1] for p in points)
+    max_x = max(p[0] for p in points)
+    max_y = max(p[1] for p in points)
+
+    arcs = []
+    for arc in merged['arcs']:
+        x, y = min_x, min_y
+        encoded = []
+        for px, py in arc:
+            encoded.append([px - x, py - y])
+            x, y = px, py
+        arcs.append(encoded)
+
+    def shift(geometry):
+        if geometry.get('type') == 'Point':
+            geometry['coordinates'] = [geometry['coordinates'][0] - min_x, geometry['coordinates'][1] - min_y]
+        elif geometry.get('type') == 'MultiPoint':
+            geometry['coordinates'] = [[p[0] - min_x, p[1] - min_y] for p in geometry['coordinates']]
+        elif geometry.get('type') == 'GeometryCollection':
+            for g in geometry['geometries']:
+                shift(g)
+        return geometry
+
+    geometries = [shift(g) for g in merged['geometries']]
+    dictionaries = {}
+    if dictionary_max_unique > 0:
+        properties, dictionaries = dictionary_encode_properties(
+            [g.get('properties') for g in geometries], dictionary_max_unique)
+        for geometry, props in zip(geometries, properties):
+            if props is not None:
+                geometry['properties'] = props
+
+    topo = {
+        'type': 'Topology',
+        'transform': {
+            'scale': [precision, precision],
+            'translate': [min_x * precision, min_y * precision]
+        },
+        'bbox': [min_x * precision, min_y * precision, max_x * precision, max_y * precision],
+        'objects': {
+            'data': {
+                'type': 'GeometryCollection',
+                'geometries': geometries
+            }
+        },
+        'arcs': arcs
+    }
+    if dictionaries:
+        topo['dictionaries'] = dictionaries
+    return topo
+
+
+def merge_topologies(paths: List[str], precision: float = 0.000001,
+                     workers: Optional[int] = None) -> dict:
+    """Merge per-file TopoJSON outputs with a parallel pairwise merge tree."""
+    if not paths:
+        raise ValueError("No topologies to merge")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        level = list(executor.map(_load_quantized_args, [(p, precision) for p in paths]))
+        depth = 0
+        while len(level) > 1:
+            depth += 1
+            pairs = [(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            carry = [level[-1]] if len(level) % 2 else []
+            print(f"Merge level {depth}: {len(pairs)} merges")
+            level = list(executor.map(_merge_pair_args, pairs)) + carry
+
+    merged = level[0]
+    print(f"Merged {len(paths)} files: {merged['input_arcs']:,} arcs in, {len(merged['arcs']):,} arcs out")
+    return merged
+
+
+def simplify_merged(merged: dict, precision: float, tolerance: float, algorithm: str = "dp",
+                    workers: Optional[int] = None) -> dict:
+    """Simplify each merged arc once, then snap it back onto the grid. Arc
+    endpoints are kept, so features sharing an arc still meet exactly."""
+    from app.server.arc_simplify import simplify_topology
+
+    topo = {'arcs': [[[x * precision, y * precision] for x, y in arc] for arc in merged['arcs']]}
+    simplify_topology(topo, tolerance, algorithm, workers=workers)
+    merged['arcs'] = [_quantize_arc(arc, precision) for arc in topo['arcs']]
+    return merged
+
+
+def _region_for(filename: str, region_precision: int) -> str:
+    # Per-file outputs are named {base}.{geohash}.topojson
+    if region_precision <= 0:
+        return "national"
+    parts = filename.split('.')
+    if len(parts) < 3:
+        return "national"
+    return parts[-2][:region_precision]
+
+
+def merge_layer(output_dir: str, layer_name: str, precision: float = 0.000001,
+                region_precision: int = 0, workers: Optional[int] = None,
+                dictionary_max_unique: int = 0, attribute_mode: str = "inline",
+                tolerance: float = 0.0, simplify_algorithm: str = "dp") -> List[str]:
+    """Merge a layer's files per region. Files are read from their
+    unsimplified copies where the processor kept one, and the merged arcs
+    are then simplified once with `tolerance`."""
+    layer_dir = os.path.join(output_dir, layer_name)
+    if not os.path.isdir(layer_dir):
+        raise FileNotFoundError(f"Layer directory not found: {layer_dir}")
+
+    regions: Dict[str, List[str]] = defaultdict(list)
+    simplified = 0
+    for filename in sorted(os.listdir(layer_dir)):
+        if filename.endswith('.topojson'):
+            path = merge_source_path(layer_dir, filename)
+            if not os.path.exists(path):
+                path = os.path.join(layer_dir, filename)
+                simplified += 1
+            regions[_region_for(filename, region_precision)].append(path)
+    if simplified:
+        logging.warning(f"{simplified} {layer_name} files have no unsimplified copy; their shared "
+                        f"borders may not deduplicate until they are reprocessed with merge_outputs on")
+
+    merged_layer = merged_layer_name(layer_name)
+    merged_dir = os.path.join(output_dir, merged_layer)
+    os.makedirs(merged_dir, exist_ok=True)
+
+    outputs = []
+    for region, paths in sorted(regions.items()):
+        print(f"\nMerging {len(paths)} {layer_name} files for region {region}")
+        merged = merge_topologies(paths, precision=precision, workers=workers)
+        if tolerance > 0:
+            simplify_merged(merged, precision, tolerance, simplify_algorithm, workers=workers)
+        output_filename = f"{layer_name}.{region}.topojson"
+        output_path = os.path.join(merged_dir, output_filename)
+
+        # Per-file ids repeat across files, so number the merged features afresh
+        properties = []
+        for feature_id, geometry in enumerate(merged['geometries']):
+            geometry['id'] = feature_id
+            if attribute_mode == "sidecar":
+                properties.append(geometry.pop('properties', None) or {})
+
+        sidecar_name = None
+        if attribute_mode == "sidecar":
+            import pandas as pd
+
+            sidecar_name = sidecar_filename(output_filename)
+            write_sidecar(pd.DataFrame(properties), os.path.join(merged_dir, sidecar_name), dictionary_max_unique)
+
+        topo = to_topojson(merged, precision, dictionary_max_unique)
+        if sidecar_name:
+            topo['sidecar'] = {'layer': merged_layer, 'file': sidecar_name}
+
+        tmp_path = f"{output_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(topo, f)
+        os.replace(tmp_path, output_path)
+        logging.info(f"Merged {layer_name}/{region}: {len(paths)} files into {output_path}")
+        outputs.append(output_path)
+    build_spatial_index(merged_dir)
+    return outputs
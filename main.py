@@ -1,11 +1,43 @@
 # main.py (in root directory)
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, HTTPException
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import BaseModel
+from typing import List, Optional, Tuple, Union
+import mimetypes
 import os
 
-app = FastAPI()
+from app.server.relationship_store import RelationshipStore, RELATIONSHIPS_DIR
+from app.server.attribute_sidecar import SidecarReader, SIDECAR_SUFFIX
+from app.server.spatial_index import load_spatial_index, build_spatial_index
+from app.server.job_scheduler import JobScheduler
+from app.server.point_lookup import PointLookup, MAX_POINTS
+from app.server.shared_cache import SharedCache, list_layer_files
+
+# TIGER_DATA_DIR points the server at another output directory (e.g. the
+# synthetic data scripts/load_test.py generates)
+DATA_DIR = os.environ.get("TIGER_DATA_DIR", "app/server/data")
+CONFIG_PATH = "app/server/tiger_config.yaml"
+
+relationships = RelationshipStore(os.path.join(DATA_DIR, RELATIONSHIPS_DIR))
+sidecars = SidecarReader()
+point_lookup = PointLookup(DATA_DIR)
+# Jobs write straight into the directory this server publishes
+scheduler = JobScheduler(CONFIG_PATH, DATA_DIR)
+# Listing, indexes and hot files mapped from one pack shared by all workers
+shared_cache = SharedCache(DATA_DIR, scheduler.config.processing.hot_layers,
+                           scheduler.config.processing.shared_cache_bytes)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    scheduler.start()
+    yield
+    await scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS middleware
 app.add_middleware(
@@ -16,23 +48,156 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static files (client)
-app.mount("/", StaticFiles(directory="app/client", html=True), name="client")
+class RelationshipLookup(BaseModel):
+    key: str
+    values: List[Union[int, str]]
+    columns: Optional[List[str]] = None
+
+class PointLookupRequest(BaseModel):
+    points: List[Tuple[float, float]]
+    layers: List[str]
+    columns: Optional[List[str]] = None
+
+class JobRequest(BaseModel):
+    layer: str
+    files: Optional[List[str]] = None
+    priority: int = 10
+    force: bool = False
+    refresh_catalog: bool = False
+
+# Background processing jobs. Omitting files processes whatever the catalog
+# shows as pending for the layer; lower priority values run first.
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    try:
+        job = await scheduler.submit(request.layer, request.files, request.priority,
+                                     request.force, request.refresh_catalog)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return job.to_dict()
+
+@app.get("/jobs")
+async def list_jobs():
+    return {"jobs": [job.to_dict() for job in scheduler.list_jobs()]}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return job.to_dict()
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    job = scheduler.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return StreamingResponse(scheduler.stream(job), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+# Relationship tables (FEATNAMES, ADDR, FACES, ...)
+@app.get("/api/relationships")
+async def list_relationships():
+    return {"layers": relationships.layers()}
+
+@app.post("/api/relationships/{layer_name}/lookup")
+def lookup_relationships(layer_name: str, request: RelationshipLookup):
+    try:
+        results = relationships.lookup(layer_name, request.key, request.values, request.columns)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "layer": layer_name,
+        "key": request.key,
+        "results": [{"value": value, "rows": rows} for value, rows in results.items()]
+    }
+
+# Containing polygon for a batch of (lon, lat) points in each requested layer.
+# index[i] points into features, or is -1 when no polygon contains point i.
+@app.post("/api/lookup/points")
+def lookup_points(request: PointLookupRequest):
+    if len(request.points) > MAX_POINTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_POINTS} points per request")
+    # Only published layers, so a request can never load files from elsewhere
+    published = list_layer_files(DATA_DIR)
+    for layer in request.layers:
+        if layer not in published:
+            raise HTTPException(status_code=404, detail=f"Layer not found: {layer}")
+    try:
+        results = point_lookup.lookup(request.points, request.layers, request.columns)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return {"count": len(request.points), "layers": results}
+
+# Processed layers and their TopoJSON files
+@app.get("/api/layers")
+async def list_layers():
+    cached = shared_cache.get("layers")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    return {"layers": list_layer_files(DATA_DIR)}
+
+# File bounds for a layer, built on first request if the processor has not
+# written one yet. The shared cache picks it up on the processor's next publish.
+@app.get("/api/layers/{layer_name}/index")
+def get_layer_index(layer_name: str):
+    cached = shared_cache.get(f"index/{layer_name}")
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    # Only published layers, so a request can never write an index elsewhere
+    if layer_name not in list_layer_files(DATA_DIR):
+        raise HTTPException(status_code=404, detail=f"Layer not found: {layer_name}")
+    layer_dir = os.path.join(DATA_DIR, layer_name)
+    index = load_spatial_index(layer_dir)
+    if index is None:
+        build_spatial_index(layer_dir)
+        index = load_spatial_index(layer_dir)
+    return index
+
+# Feature properties from attribute sidecars, fetched on demand by id
+@app.get("/api/attributes/{layer_name}/{file_name}")
+def get_attributes(layer_name: str, file_name: str, ids: str, columns: Optional[str] = None):
+    if not file_name.endswith(SIDECAR_SUFFIX):
+        raise HTTPException(status_code=400, detail=f"Not an attribute sidecar: {file_name}")
+    file_path = os.path.join(DATA_DIR, layer_name, file_name)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail=f"File not found: {file_path}")
+    try:
+        feature_ids = [int(i) for i in ids.split(',') if i]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="ids must be a comma-separated list of integers")
+
+    properties = sidecars.get(file_path, feature_ids, columns.split(',') if columns else None)
+    return {"properties": {str(k): v for k, v in properties.items()}}
 
 # Serve data files
 @app.get("/{layer_name}/{file_name}")
 async def get_data_file(layer_name: str, file_name: str):
-    file_path = os.path.join("app/server/data", layer_name, file_name)
+    # Same type from the cache and from disk, whichever worker answers
+    media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    cached = shared_cache.get(f"file/{layer_name}/{file_name}")
+    if cached is not None:
+        scheduler.record_hit(layer_name)
+        return Response(content=cached, media_type=media_type)
+
+    file_path = os.path.join(DATA_DIR, layer_name, file_name)
     
     if not os.path.exists(file_path):
         raise HTTPException(status_code=404, detail=f"File not found: {file_path}")
-        
-    return FileResponse(file_path)
+
+    scheduler.record_hit(layer_name)
+    return FileResponse(file_path, media_type=media_type)
 
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    return {"status": "ok"}
+    # pid tells load tests which worker answered
+    return {"status": "ok", "pid": os.getpid()}
+
+# Mount static files (client) last so it does not shadow the routes above
+app.mount("/", StaticFiles(directory="app/client", html=True), name="client")
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,73 @@
+import argparse
+import json
+import logging
+import time
+import urllib.request
+
+import numpy as np
+
+from app.server.point_lookup import PointLookup
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Continental US, where every polygon layer has coverage
+EXTENT = (-125.0, 24.0, -66.0, 50.0)
+
+
+def random_points(count: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    west, south, east, north = EXTENT
+    return np.column_stack([rng.uniform(west, east, count), rng.uniform(south, north, count)])
+
+
+def benchmark_library(data_dir: str, layers, batch_sizes, repeats: int):
+    lookup = PointLookup(data_dir)
+    for layer in layers:
+        started = time.perf_counter()
+        polygons = lookup.layer(layer)
+        logging.info(f"{layer}: loaded {len(polygons):,} polygons in {time.perf_counter() - started:.2f}s")
+
+    for batch in batch_sizes:
+        points = random_points(batch)
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            lookup.lookup(points, layers)
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        logging.info(f"in-process  batch {batch:>7,}: {best * 1000:8.1f}ms  "
+                     f"{batch * len(layers) / best:>12,.0f} point-layers/s")
+
+
+def benchmark_endpoint(url: str, layers, batch_sizes, repeats: int):
+    for batch in batch_sizes:
+        body = json.dumps({'points': random_points(batch).tolist(), 'layers': layers}).encode()
+        timings = []
+        for _ in range(repeats):
+            request = urllib.request.Request(f"{url}/api/lookup/points", data=body,
+                                             headers={'Content-Type': 'application/json'})
+            started = time.perf_counter()
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            timings.append(time.perf_counter() - started)
+        best = min(timings)
+        logging.info(f"HTTP        batch {batch:>7,}: {best * 1000:8.1f}ms  "
+                     f"{batch * len(layers) / best:>12,.0f} point-layers/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure batch point-in-polygon lookup throughput")
+    parser.add_argument('layers', nargs='+', help="polygon layers to query, e.g. STATE COUNTY")
+    parser.add_argument('--data-dir', default="app/server/data")
+    parser.add_argument('--batch', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--url', help="also time POST /api/lookup/points on a running server, "
+                                      "e.g. http://localhost:8000")
+    args = parser.parse_args()
+
+    benchmark_library(args.data_dir, args.layers, args.batch, args.repeats)
+    if args.url:
+        benchmark_endpoint(args.url, args.layers, args.batch, args.repeats)
@@ -1,7 +1,10 @@
 import json
-from pathlib import Path
 import logging
-from datetime import datetime
+import os
+import sys
+
+from app.server.shared_cache import bump_generation
+from app.server.spatial_index import build_spatial_index
 
 logging.basicConfig(
     level=logging.INFO,
@@ -9,40 +12,17 @@ logging.basicConfig(
 )
 
 
-def generate_spatial_index():
-    base_dir = Path("tiger_processed/ROADS")
-    index = {"files": []}
-
-    logging.info(f"Starting index generation from {base_dir}")
-
-    for file in base_dir.glob("*.topojson"):
-        try:
-            with open(file, 'r') as f:
-                data = json.load(f)
-                bbox = data.get('bbox')  # [west, south, east, north]
-                if bbox:
-                    index["files"].append({
-                        "filename": file.name,
-                        "bounds": {
-                            "west": bbox[0],
-                            "south": bbox[1],
-                            "east": bbox[2],
-                            "north": bbox[3]
-                        }
-                    })
-                    logging.info(f"Processed {file.name}")
-                else:
-                    logging.warning(f"No bbox found in {file.name}")
-        except Exception as e:
-            logging.error(f"Error processing {file.name}: {str(e)}")
-
-    index_file = base_dir / "spatial_index.json"
-    with open(index_file, 'w') as f:
-        json.dump(index, f, indent=2)
+def generate_spatial_index(layer_dir: str = "tiger_processed/ROADS"):
+    logging.info(f"Starting index generation from {layer_dir}")
+    index_file = build_spatial_index(layer_dir)
+    with open(index_file, 'r') as f:
+        count = len(json.load(f)['files'])
+    # Running servers pick up the new index on their next generation check
+    bump_generation(os.path.dirname(os.path.abspath(layer_dir)), [os.path.basename(os.path.abspath(layer_dir))])
 
-    logging.info(f"Index generated with {len(index['files'])} files")
+    logging.info(f"Index generated with {count} files")
     logging.info(f"Index saved to {index_file}")
 
 
 if __name__ == "__main__":
-    generate_spatial_index()
\ No newline at end of file
+    generate_spatial_index(sys.argv[1] if len(sys.argv) > 1 else "tiger_processed/ROADS")
@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from datetime import datetime
+
+import aiohttp
+import numpy as np
+
+from app.server.spatial_index import build_spatial_index
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Continental US, split into one tile per synthetic file
+EXTENT = (-125.0, 24.0, -66.0, 50.0)
+DEFAULT_MIX = "file=60,index=20,lookup=10,health=10"
+
+
+def _ring(x0: float, y0: float, x1: float, y1: float, vertices: int) -> list:
+    """A square ring densified to `vertices` points per side, delta-free."""
+    steps = np.linspace(0, 1, vertices, endpoint=False)
+    sides = [
+        [(x0 + (x1 - x0) * t, y0) for t in steps],
+        [(x1, y0 + (y1 - y0) * t) for t in steps],
+        [(x1 - (x1 - x0) * t, y1) for t in steps],
+        [(x0, y1 - (y1 - y0) * t) for t in steps],
+    ]
+    ring = [[round(x, 6), round(y, 6)] for side in sides for x, y in side]
+    return ring + [ring[0]]
+
+
+def generate_layer(layer_dir: str, name: str, files: int, features: int, vertices: int):
+    """Write `files` TopoJSON tiles covering EXTENT, each a grid of square
+    polygons, plus the layer's spatial index."""
+    os.makedirs(layer_dir, exist_ok=True)
+    columns = int(np.ceil(np.sqrt(files)))
+    rows = int(np.ceil(files / columns))
+    grid = int(np.ceil(np.sqrt(features)))
+    west, south, east, north = EXTENT
+    tile_w, tile_h = (east - west) / columns, (north - south) / rows
+
+    for index in range(files):
+        tx0 = west + (index % columns) * tile_w
+        ty0 = south + (index // columns) * tile_h
+        arcs, geometries = [], []
+        for f in range(grid * grid):
+            cx0 = tx0 + (f % grid) * tile_w / grid
+            cy0 = ty0 + (f // grid) * tile_h / grid
+            arcs.append(_ring(cx0, cy0, cx0 + tile_w / grid, cy0 + tile_h / grid, vertices))
+            geometries.append({
+                'type': 'Polygon',
+                'arcs': [[f]],
+                'id': f,
+                'properties': {'GEOID': f"{index:03d}{f:05d}", 'NAME': f"{name} {index}-{f}"}
+            })
+        topo = {
+            'type': 'Topology',
+            'bbox': [tx0, ty0, tx0 + tile_w, ty0 + tile_h],
+            'objects': {'data': {'type': 'GeometryCollection', 'geometries': geometries}},
+            'arcs': arcs
+        }
+        with open(os.path.join(layer_dir, f"tl_2023_{index:03d}_{name.lower()}.t{index:03d}.topojson"), 'w') as f:
+            json.dump(topo, f)
+    build_spatial_index(layer_dir)
+
+
+def generate_data(data_dir: str, layers: int, files: int, features: int, vertices: int) -> list:
+    names = [f"LOAD{i}" for i in range(layers)]
+    for name in names:
+        generate_layer(os.path.join(data_dir, name), name, files, features, vertices)
+    size = sum(os.path.getsize(os.path.join(root, f)) for root, _, fs in os.walk(data_dir) for f in fs)
+    logging.info(f"Synthetic data: {layers} layers x {files} files x {features} features "
+                 f"({size / (1024 * 1024):.1f}MB) in {data_dir}")
+    return names
+
+
+def load_indexes(data_dir: str, layers: list) -> dict:
+    indexes = {}
+    for layer in layers:
+        with open(os.path.join(data_dir, layer, 'spatial_index.json')) as f:
+            indexes[layer] = json.load(f)['files']
+    return indexes
+
+
+class RequestMix:
+    """Draws requests the way the client issues them: spatial index fetches,
+    the files intersecting a random viewport, point lookups and health checks."""
+
+    def __init__(self, indexes: dict, weights: dict, seed: int, lookup_points: int):
+        self.indexes = indexes
+        self.layers = sorted(indexes)
+        self.ops = list(weights)
+        self.weights = [weights[op] for op in self.ops]
+        self.random = random.Random(seed)
+        self.lookup_points = lookup_points
+
+    def _viewport_file(self, layer: str) -> str:
+        west, south, east, north = EXTENT
+        width = self.random.uniform(2, 15)
+        height = width / 2
+        x = self.random.uniform(west, east - width)
+        y = self.random.uniform(south, north - height)
+        hits = [e['filename'] for e in self.indexes[layer]
+                if e['bounds']['west'] <= x + width and e['bounds']['east'] >= x and
+                e['bounds']['south'] <= y + height and e['bounds']['north'] >= y]
+        return self.random.choice(hits or [e['filename'] for e in self.indexes[layer]])
+
+    def next(self):
+        op = self.random.choices(self.ops, self.weights)[0]
+        layer = self.random.choice(self.layers)
+        if op == 'file':
+            return op, 'GET', f"/{layer}/{self._viewport_file(layer)}", None
+        if op == 'index':
+            return op, 'GET', f"/api/layers/{layer}/index", None
+        if op == 'lookup':
+            west, south, east, north = EXTENT
+            points = [[self.random.uniform(west, east), self.random.uniform(south, north)]
+                      for _ in range(self.lookup_points)]
+            return op, 'POST', "/api/lookup/points", {'points': points, 'layers': [layer]}
+        return op, 'GET', "/health", None
+
+
+async def warm_up(base_url: str, layers: list, workers: int, attempts: int = 200):
+    """Issue one lookup per layer to every worker, so no measured request
+    pays for loading a layer's polygons. A worker answers every request on
+    the connection it accepted, and /health says which worker that is."""
+    west, south, east, north = EXTENT
+    point = [(west + east) / 2, (south + north) / 2]
+    warmed = set()
+    for _ in range(attempts):
+        if len(warmed) >= workers:
+            break
+        # A new connection each time so other workers get to accept it
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=1)) as session:
+            async with session.get(base_url + "/health") as response:
+                pid = (await response.json())['pid']
+            if pid in warmed:
+                continue
+            for layer in layers:
+                async with session.post(base_url + "/api/lookup/points",
+                                        json={'points': [point], 'layers': [layer]}) as response:
+                    await response.read()
+            warmed.add(pid)
+    if len(warmed) < workers:
+        logging.warning(f"Only warmed {len(warmed)} of {workers} workers")
+
+
+async def run_level(base_url: str, mix: RequestMix, concurrency: int, duration: float, warmup: float) -> dict:
+    """Closed loop: `concurrency` clients each issue one request at a time.
+    Requests finishing during warmup are not recorded."""
+    samples = []
+    errors = 0
+    started = time.perf_counter()
+    measure_from = started + warmup
+    stop_at = measure_from + duration
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=60)
+
+    async def client(session):
+        nonlocal errors
+        while time.perf_counter() < stop_at:
+            op, method, path, body = mix.next()
+            sent = time.perf_counter()
+            try:
+                async with session.request(method, base_url + path, json=body) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            done = time.perf_counter()
+            if done >= measure_from:
+                if ok:
+                    samples.append((op, done - sent))
+                else:
+                    errors += 1
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+
+    return summarize(samples, errors, duration)
+
+
+def summarize(samples: list, errors: int, duration: float) -> dict:
+    def stats(latencies):
+        if not latencies:
+            return {'count': 0}
+        p50, p95, p99 = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+        return {'count': len(latencies), 'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2)}
+
+    by_op = {}
+    for op, latency in samples:
+        by_op.setdefault(op, []).append(latency)
+    result = stats([latency for _, latency in samples])
+    result.update({
+        'errors': errors,
+        'throughput_rps': round(len(samples) / duration, 1),
+        'ops': {op: stats(latencies) for op, latencies in sorted(by_op.items())}
+    })
+    return result
+
+
+def start_server(data_dir: str, workers: int, port: int) -> subprocess.Popen:
+    env = dict(os.environ, TIGER_DATA_DIR=data_dir)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--log-level', 'warning', '--no-access-log',
+         '--http', 'app.server.http_protocol:NoDelayHTTPProtocol'],
+        env=env)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                if response.status == 200:
+                    return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become healthy within 60s")
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def print_report(results: list):
+    print(f"\n{'workers':>7} {'conc':>5} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['concurrency']:>5} {r['throughput_rps']:>9,.1f} "
+              f"{r.get('p50_ms', 0):>9.2f} {r.get('p95_ms', 0):>9.2f} {r.get('p99_ms', 0):>9.2f} {r['errors']:>7}")
+        for op, s in r['ops'].items():
+            print(f"{'':>13} {op:<8} n={s['count']:<7} p50 {s['p50_ms']:.2f}  p95 {s['p95_ms']:.2f}  p99 {s['p99_ms']:.2f}")
+
+
+def parse_mix(text: str) -> dict:
+    weights = {}
+    for part in text.split(','):
+        op, weight = part.split('=')
+        if op not in ('file', 'index', 'lookup', 'health'):
+            raise ValueError(f"Unknown request type in mix: {op}")
+        weights[op] = float(weight)
+    return weights
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Start the data server on synthetic data and measure throughput and latency")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="uvicorn worker counts")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32, 64],
+                        help="concurrent clients")
+    parser.add_argument('--duration', type=float, default=10, help="measured seconds per level")
+    parser.add_argument('--warmup', type=float, default=2, help="unrecorded seconds before each level")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="request weights, e.g. file=60,index=20,lookup=10,health=10")
+    parser.add_argument('--seed', type=int, default=1, help="seeds the request sequence")
+    parser.add_argument('--layers', type=int, default=3)
+    parser.add_argument('--files', type=int, default=16, help="files per layer")
+    parser.add_argument('--features', type=int, default=400, help="polygons per file")
+    parser.add_argument('--vertices', type=int, default=16, help="vertices per polygon side")
+    parser.add_argument('--lookup-points', type=int, default=1000, help="points per lookup request")
+    parser.add_argument('--data-dir', help="serve an existing output directory instead of synthetic data")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--output', help="write results as JSON for comparing runs")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory(prefix="tiger_load_") as tmp:
+        if args.data_dir:
+            data_dir = os.path.abspath(args.data_dir)
+            layers = [d for d in sorted(os.listdir(data_dir))
+                      if os.path.exists(os.path.join(data_dir, d, 'spatial_index.json'))]
+        else:
+            data_dir = tmp
+            layers = generate_data(data_dir, args.layers, args.files, args.features, args.vertices)
+        indexes = load_indexes(data_dir, layers)
+
+        results = []
+        for workers in args.workers:
+            server = start_server(data_dir, workers, args.port)
+            try:
+                asyncio.run(warm_up(f"http://127.0.0.1:{args.port}", layers, workers))
+                for concurrency in args.concurrency:
+                    # Same request sequence at every level so runs are comparable
+                    mix = RequestMix(indexes, weights, args.seed, args.lookup_points)
+                    logging.info(f"workers={workers} concurrency={concurrency}")
+                    result = asyncio.run(run_level(f"http://127.0.0.1:{args.port}", mix,
+                                                   concurrency, args.duration, args.warmup))
+                    result.update(workers=workers, concurrency=concurrency)
+                    results.append(result)
+            finally:
+                stop_server(server)
+
+    print_report(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'timestamp': datetime.now().isoformat(timespec='seconds'),
+                'settings': {k: v for k, v in vars(args).items() if k != 'output'},
+                'cpus': os.cpu_count(),
+                'results': results
+            }, f, indent=2)
+        logging.info(f"Wrote {args.output}")